@@ -5,9 +5,12 @@ from typing import Mapping, Union, List, Tuple
 from urllib.parse import quote, parse_qsl
 
 from fastapi import Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import cache
 import crud
+import integrity
+import metrics
 from database import get_db
 
 def _get_canonical_headers(headers: Mapping[str, str]) -> tuple[str, str]:
@@ -21,7 +24,7 @@ def _get_canonical_headers(headers: Mapping[str, str]) -> tuple[str, str]:
 def _get_canonical_request(request: Request, signed_headers: str, payload_hash: str) -> str:
     method = request.method
     path = request.scope['raw_path'].decode()
-    query_params = sorted(parse_qsl(request.url.query, keep_blank_values=True))
+    query_params = sorted(parse_qsl(request.scope['query_string'].decode(), keep_blank_values=True))
     
     # Sort the query parameters by key
     query = "&".join([f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in query_params])
@@ -46,7 +49,20 @@ def _get_signing_key(secret_key: str, date_stamp: str, region: str, service: str
     k_signing = hmac.new(k_service, b"aws4_request", hashlib.sha256).digest()
     return k_signing
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+def _get_cached_signing_key(user: cache.UserInfo, date_stamp: str, region: str, service: str) -> bytes:
+    """The signing key only changes daily per credential scope, so derive it once."""
+    cache_key = (user.access_key, date_stamp, region, service)
+    signing_key = cache.signing_keys.get(cache_key)
+    if signing_key is None:
+        signing_key = _get_signing_key(user.secret_key, date_stamp, region, service)
+        cache.signing_keys.set(cache_key, signing_key)
+    return signing_key
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> cache.UserInfo:
+    with metrics.phase("auth"):
+        return await _authenticate(request, db)
+
+async def _authenticate(request: Request, db: AsyncSession) -> cache.UserInfo:
     auth_header = request.headers.get("authorization")
     if not auth_header or not auth_header.startswith("AWS4-HMAC-SHA256"):
         raise HTTPException(status_code=403, detail="Invalid authorization header")
@@ -74,7 +90,7 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
     except (ValueError, KeyError, IndexError) as e:
         raise HTTPException(status_code=403, detail=f"Malformed authorization header parts: {e}")
 
-    user = crud.get_user_by_access_key(db, access_key)
+    user = await crud.get_user_info(db, access_key)
     if not user:
         raise HTTPException(status_code=403, detail="Invalid access key")
 
@@ -87,7 +103,7 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
     scope = f"{date_stamp}/{region}/{service}/aws4_request"
     string_to_sign = _get_string_to_sign(canonical_request_hash, timestamp, scope)
 
-    signing_key = _get_signing_key(user.secret_key, date_stamp, region, service)
+    signing_key = _get_cached_signing_key(user, date_stamp, region, service)
 
     calculated_signature = hmac.new(
         signing_key, string_to_sign.encode(), hashlib.sha256
@@ -96,4 +112,8 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
     if calculated_signature != signature:
         raise HTTPException(status_code=403, detail="Signature does not match")
 
+    if payload_hash in (integrity.STREAMING_SIGNED, integrity.STREAMING_SIGNED_TRAILER):
+        # Each chunk of the body is signed, chained from this request's signature
+        request.state.chunk_signer = integrity.ChunkSigner(signing_key, signature, timestamp, scope)
+
     return user
\ No newline at end of file
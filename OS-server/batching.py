@@ -0,0 +1,100 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+import metrics
+from config import WRITE_BATCH_MAX_SIZE, WRITE_BATCH_WINDOW_MS
+from database import SessionLocal
+
+
+class WriteBatcher:
+    """
+    Group commit for metadata writes. Mutations submitted by concurrent requests
+    are queued to a single writer thread, which applies everything that is
+    pending in one transaction and one commit. Each caller gets its result only
+    once the transaction holding its write has committed.
+
+    A write is a callable taking a Session as its first argument that must not
+    commit. If a batch fails, its writes are retried one transaction each, so
+    a failing write only affects its own caller.
+    """
+
+    def __init__(self, max_size: int, window_seconds: float):
+        self.max_size = max_size
+        self.window_seconds = window_seconds
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="s3-metadata-writer", daemon=True)
+        self._thread.start()
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Queues a write and blocks until it has been committed. Returns its result."""
+        return self._enqueue(func, args, kwargs).result()
+
+    async def submit(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Queues a write and waits, without blocking the event loop, until it has been committed."""
+        with metrics.phase("db"):
+            return await asyncio.wrap_future(self._enqueue(func, args, kwargs))
+
+    def pending(self) -> int:
+        """Returns the number of writes waiting for the writer thread."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Commits the writes still queued and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _enqueue(self, func, args, kwargs) -> Future:
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def _next_batch(self) -> list | None:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_size:
+            try:
+                # Whatever queued up during the previous commit is taken without waiting
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0)) if self.window_seconds else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            db = SessionLocal()
+            try:
+                self._apply(db, batch)
+            finally:
+                db.close()
+
+    def _apply(self, db: Session, batch: list):
+        try:
+            results = [func(db, *args, **kwargs) for func, args, kwargs, _ in batch]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(batch) == 1:
+                batch[0][3].set_exception(e)
+            else:
+                for item in batch:
+                    self._apply(db, [item])
+            return
+        for (_, _, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+# Shared by all requests of this worker process
+batcher = WriteBatcher(WRITE_BATCH_MAX_SIZE, WRITE_BATCH_WINDOW_MS / 1000)
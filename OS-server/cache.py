@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Hashable
+
+import metrics
+from config import CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, OBJECT_CACHE_MAX_BYTES, OBJECT_CACHE_TTL_SECONDS
+
+
+@dataclass(frozen=True)
+class UserInfo:
+    """Detached snapshot of a models.User row, safe to share across sessions and threads."""
+    id: int
+    access_key: str
+    secret_key: str
+
+
+@dataclass(frozen=True)
+class BucketInfo:
+    """Detached snapshot of a models.Bucket row."""
+    id: int
+    name: str
+    owner_id: int
+    compression: str | None = None
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    """
+    Detached snapshot of a models.Object row. data holds the object's
+    (uncompressed) contents if they are stored inline or were cached, and is
+    None otherwise.
+    """
+    id: int
+    bucket_id: int
+    name: str
+    size: int
+    etag: str
+    filepath: str
+    content_type: str
+    last_modified: datetime
+    part_sizes: str | None
+    data: bytes | None = None
+    compression: str | None = None
+
+
+class TTLCache:
+    """A thread-safe LRU mapping bounded by entry count whose entries also expire after a TTL."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ObjectCache:
+    """
+    A thread-safe LRU cache of ObjectInfo snapshots, bounded by the total size
+    of the cached bodies plus a fixed overhead per entry, whose entries also
+    expire after a TTL.
+
+    A lookup that misses takes generation() before reading the database and
+    passes it to set(): if that key was invalidated in the meantime, the
+    possibly outdated snapshot is not cached. Invalidations are stamped per
+    key; once more than MAX_STAMPS are tracked the oldest are dropped, and
+    fills that started before a dropped stamp are refused.
+    """
+    ENTRY_OVERHEAD = 512  # Rough bytes per entry for the snapshot itself
+    MAX_STAMPS = 10000  # Invalidation stamps kept for in-flight fills
+
+    def __init__(self, max_bytes: int = OBJECT_CACHE_MAX_BYTES, ttl: float = OBJECT_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: OrderedDict[Hashable, tuple[float, ObjectInfo, int]] = OrderedDict()
+        self._generation = 0
+        # key -> generation it was last invalidated at, oldest first
+        self._stamps: OrderedDict[Hashable, int] = OrderedDict()
+        # Fills taken before this generation are refused
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def _weight(self, info: ObjectInfo) -> int:
+        return self.ENTRY_OVERHEAD + len(info.name) + len(info.data or b"")
+
+    def _remove(self, key: Hashable):
+        _, _, weight = self._entries.pop(key)
+        self.size -= weight
+
+    def get(self, key: Hashable) -> ObjectInfo | None:
+        if not self.max_bytes:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                metrics.OBJECT_CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+        metrics.OBJECT_CACHE_HITS.inc()
+        return entry[1]
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set(self, key: Hashable, info: ObjectInfo, since: int):
+        weight = self._weight(info)
+        if weight > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            if since < self._floor or self._stamps.get(key, -1) >= since:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, info, weight)
+            self.size += weight
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        if evicted:
+            metrics.OBJECT_CACHE_EVICTIONS.inc(evicted)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._stamps[key] = self._generation
+            self._stamps.move_to_end(key)
+            self._generation += 1
+            while len(self._stamps) > self.MAX_STAMPS:
+                self._floor = self._stamps.popitem(last=False)[1] + 1
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+# access_key -> UserInfo
+users = TTLCache()
+# bucket name -> BucketInfo
+buckets = TTLCache()
+# (access_key, date_stamp, region, service) -> derived SigV4 signing key
+signing_keys = TTLCache()
+# (bucket_id, key) -> ObjectInfo
+objects = ObjectCache()
@@ -0,0 +1,149 @@
+import os
+import struct
+import zlib
+from typing import BinaryIO, Iterator
+
+from config import COMPRESSION_FRAME_SIZE
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for buckets using zstd
+    zstandard = None
+
+# A compressed object is a series of independently compressed frames of
+# frame_size logical bytes each (the last may be shorter), followed by a seek
+# table holding the stored size of every frame, then a fixed-size footer. A
+# byte range is read by decompressing only the frames that overlap it.
+MAGIC = b"S3zf"
+_FOOTER = struct.Struct("<QQI4s")  # logical size, frame count, frame size, magic
+_FRAME_SIZE = struct.Struct("<I")
+
+# Content types that are compressed without sampling the data first
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/xml", "application/x-ndjson", "application/javascript", "application/csv", "application/yaml")
+# Bytes of the first chunk compressed to decide whether other content types are worth it
+SAMPLE_SIZE = 64 * 1024
+# Data is stored compressed only if the sample shrinks to at most this fraction
+MAX_SAMPLE_RATIO = 0.9
+
+
+class _Zlib:
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, 6)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class _Zstd:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+ALGORITHMS = {"zlib": _Zlib, "zstd": _Zstd}
+
+
+def available(algorithm: str) -> bool:
+    """True if the server can compress with algorithm."""
+    return algorithm == "zlib" or (algorithm == "zstd" and zstandard is not None)
+
+
+def worth_compressing(algorithm: str, content_type: str | None, sample: bytes) -> bool:
+    """Decides from the content type, or else from how well the first chunk compresses, whether to compress an object."""
+    if content_type and content_type.lower().startswith(COMPRESSIBLE_TYPES):
+        return True
+    sample = bytes(sample[:SAMPLE_SIZE])
+    return bool(sample) and len(ALGORITHMS[algorithm]().compress(sample)) <= len(sample) * MAX_SAMPLE_RATIO
+
+
+class FrameWriter:
+    """Compresses everything written to it into seekable frames on file."""
+
+    def __init__(self, file: BinaryIO, algorithm: str, frame_size: int = COMPRESSION_FRAME_SIZE):
+        self._file = file
+        self._codec = ALGORITHMS[algorithm]()
+        self.frame_size = frame_size
+        self.logical_size = 0
+        self.stored_size = 0
+        self._buffer = bytearray()
+        self._frame_sizes = []
+
+    def _emit(self, data: bytes):
+        frame = self._codec.compress(data)
+        self._file.write(frame)
+        self._frame_sizes.append(len(frame))
+        self.stored_size += len(frame)
+
+    def write(self, data: bytes):
+        self.logical_size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.frame_size:
+            self._emit(bytes(self._buffer[:self.frame_size]))
+            del self._buffer[:self.frame_size]
+
+    def close(self):
+        """Writes the last frame, the seek table and the footer."""
+        if self._buffer:
+            self._emit(bytes(self._buffer))
+            self._buffer.clear()
+        trailer = b"".join(_FRAME_SIZE.pack(size) for size in self._frame_sizes)
+        trailer += _FOOTER.pack(self.logical_size, len(self._frame_sizes), self.frame_size, MAGIC)
+        self._file.write(trailer)
+        self.stored_size += len(trailer)
+
+
+class FrameReader:
+    """Random access to the logical data of a compressed object file, given an open descriptor."""
+
+    def __init__(self, fd: int, algorithm: str):
+        self._fd = fd
+        self._codec = ALGORITHMS[algorithm]()
+        file_size = os.fstat(fd).st_size
+        if file_size < _FOOTER.size:
+            raise ValueError("Not a compressed object file")
+        footer = os.pread(fd, _FOOTER.size, file_size - _FOOTER.size)
+        self.logical_size, frame_count, self.frame_size, magic = _FOOTER.unpack(footer)
+        if magic != MAGIC:
+            raise ValueError("Not a compressed object file")
+        table_size = frame_count * _FRAME_SIZE.size
+        table = os.pread(fd, table_size, file_size - _FOOTER.size - table_size)
+        self._offsets = [0]
+        for (size,) in _FRAME_SIZE.iter_unpack(table):
+            self._offsets.append(self._offsets[-1] + size)
+
+    def read_frame(self, index: int) -> bytes:
+        """Decompresses one frame."""
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._codec.decompress(os.pread(self._fd, end - start, start))
+
+    def slices(self, start: int, end: int) -> list[tuple[int, int, int]]:
+        """
+        Maps the inclusive logical range [start, end] to the frames holding it,
+        as (frame index, start, stop) slices of each decompressed frame.
+        """
+        first, last = start // self.frame_size, end // self.frame_size
+        return [
+            (index, max(start - index * self.frame_size, 0), min(end - index * self.frame_size, self.frame_size - 1) + 1)
+            for index in range(first, last + 1)
+        ]
+
+    def read(self, start: int, end: int) -> Iterator[bytes]:
+        """Yields the logical bytes in the inclusive range [start, end], one frame at a time."""
+        for index, lo, hi in self.slices(start, end):
+            yield self.read_frame(index)[lo:hi]
+
+
+def read_all(filepath: str, algorithm: str) -> bytes:
+    """Decompresses a whole object file into memory."""
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        reader = FrameReader(fd, algorithm)
+        return b"".join(reader.read(0, reader.logical_size - 1)) if reader.logical_size else b""
+    finally:
+        os.close(fd)
@@ -1,93 +1,527 @@
-from sqlalchemy.orm import Session
+import base64
+import functools
+import json
+from collections import Counter
+from datetime import datetime
+from typing import Callable
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer
+from sqlalchemy.dialects import postgresql, sqlite
+import cache
 import models
-from sqlalchemy import asc
-def get_user_by_access_key(db: Session, access_key: str):
-    return db.query(models.User).filter(models.User.access_key == access_key).first()
+from sqlalchemy import asc, delete, select, update
 
-def get_bucket_by_name(db: Session, name: str):
-    return db.query(models.Bucket).filter(models.Bucket.name == name).first()
+# Rows fetched per round trip while walking a listing
+LIST_FETCH_SIZE = 64
+# Server-side cap on keys returned by a single listing page, as in S3
+MAX_LIST_KEYS = 1000
+# Objects fetched per query while streaming a prefix as an archive
+ARCHIVE_PAGE_SIZE = 128
 
-def get_object_by_bucket_and_name(db: Session, bucket_id: int, name: str):
-    """Fetches an object from the database by its bucket and name."""
-    return db.query(models.Object).filter(
+def _insert(db: Session):
+    """Returns the dialect-specific insert() construct, which supports ON CONFLICT."""
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+@functools.cache
+def _upsert_object_stmt(dialect_name: str):
+    """
+    Builds the object upsert once per dialect; constructing it (notably the
+    excluded columns) costs more than executing it.
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(models.Object)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Object.bucket_id, models.Object.name],
+        set_={key: stmt.excluded[key] for key in ("size", "etag", "filepath", "content_type", "last_modified", "part_sizes", "data", "compression", "stored_size")},
+    )
+
+@functools.cache
+def _insert_new_object_stmt(dialect_name: str):
+    """Builds the insert that only creates keys that don't exist yet, returning the names it created."""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    return insert(models.Object).on_conflict_do_nothing(
+        index_elements=[models.Object.bucket_id, models.Object.name],
+    ).returning(models.Object.name)
+
+@functools.cache
+def _upsert_part_stmt(dialect_name: str):
+    """Builds the multipart part upsert once per dialect."""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(models.MultipartPart)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.MultipartPart.upload_id, models.MultipartPart.part_number],
+        set_={key: stmt.excluded[key] for key in ("etag", "filepath", "size")},
+    )
+
+async def get_user_by_access_key(db: AsyncSession, access_key: str):
+    return await db.scalar(select(models.User).where(models.User.access_key == access_key))
+
+async def get_user_info(db: AsyncSession, access_key: str) -> cache.UserInfo | None:
+    """Cached variant of get_user_by_access_key returning a detached snapshot."""
+    user_info = cache.users.get(access_key)
+    if user_info is None:
+        user = await get_user_by_access_key(db, access_key)
+        if not user:
+            return None
+        user_info = cache.UserInfo(id=user.id, access_key=user.access_key, secret_key=user.secret_key)
+        cache.users.set(access_key, user_info)
+    return user_info
+
+async def get_bucket_by_name(db: AsyncSession, name: str):
+    return await db.scalar(select(models.Bucket).where(models.Bucket.name == name))
+
+async def get_bucket_info(db: AsyncSession, name: str) -> cache.BucketInfo | None:
+    """Cached variant of get_bucket_by_name returning a detached snapshot."""
+    bucket_info = cache.buckets.get(name)
+    if bucket_info is None:
+        bucket = await get_bucket_by_name(db, name)
+        if not bucket:
+            return None
+        bucket_info = cache.BucketInfo(id=bucket.id, name=bucket.name, owner_id=bucket.owner_id, compression=bucket.compression)
+        cache.buckets.set(name, bucket_info)
+    return bucket_info
+
+async def bucket_has_objects(db: AsyncSession, bucket_id: int) -> bool:
+    return await db.scalar(select(models.Object.id).where(models.Object.bucket_id == bucket_id).limit(1)) is not None
+
+async def get_object_by_bucket_and_name(db: AsyncSession, bucket_id: int, name: str, with_data: bool = False):
+    """
+    Fetches an object from the database by its bucket and name. with_data also
+    loads the contents of inline objects, for requests that serve or copy them.
+    """
+    stmt = select(models.Object).where(
         models.Object.bucket_id == bucket_id,
         models.Object.name == name
-    ).first()
-def list_objects(db: Session, bucket_id: int, prefix: str, marker: str, limit: int):
-    """Lists objects in a bucket with pagination."""
-    query = db.query(models.Object).filter(models.Object.bucket_id == bucket_id)
-    
-    if prefix:
-        query = query.filter(models.Object.name.startswith(prefix))
-        
-    if marker:
-        query = query.filter(models.Object.name > marker)
-        
-    objects = query.order_by(asc(models.Object.name)).limit(limit + 1).all()
-    
-    is_truncated = len(objects) > limit
-    next_marker = None
-    
-    if is_truncated:
-        # The last object is the marker for the next page
-        next_marker = objects[limit - 1].name
-        # Return only the requested number of objects
-        objects = objects[:limit]
-        
-    return objects, is_truncated, next_marker
-def create_bucket(db: Session, name: str, owner_id: int):
+    )
+    if with_data:
+        stmt = stmt.options(undefer(models.Object.data))
+    return await db.scalar(stmt)
+
+def _object_info(db_object: models.Object) -> cache.ObjectInfo:
+    """Snapshots an object row that was loaded with its data."""
+    return cache.ObjectInfo(
+        id=db_object.id,
+        bucket_id=db_object.bucket_id,
+        name=db_object.name,
+        size=db_object.size,
+        etag=db_object.etag,
+        filepath=db_object.filepath,
+        content_type=db_object.content_type,
+        last_modified=db_object.last_modified,
+        part_sizes=db_object.part_sizes,
+        data=db_object.data,
+        compression=db_object.compression,
+    )
+
+async def get_object_info(db: AsyncSession, bucket_id: int, name: str) -> cache.ObjectInfo | None:
+    """
+    Cached variant of get_object_by_bucket_and_name returning a detached
+    snapshot, including the contents of inline objects.
+    """
+    object_info = cache.objects.get((bucket_id, name))
+    if object_info is None:
+        since = cache.objects.generation()
+        db_object = await get_object_by_bucket_and_name(db, bucket_id, name, with_data=True)
+        if not db_object:
+            return None
+        object_info = _object_info(db_object)
+        cache.objects.set((bucket_id, name), object_info, since)
+    return object_info
+
+async def get_object_page(db: AsyncSession, bucket_id: int, prefix: str, after: str | None, limit: int) -> list[cache.ObjectInfo]:
+    """
+    Returns up to limit objects under prefix with keys after the given one, in
+    key order, as detached snapshots including the contents of inline objects.
+    Used to walk a prefix page by page without holding a session in between.
+    """
+    query = select(models.Object).options(undefer(models.Object.data)).where(models.Object.bucket_id == bucket_id)
+    upper = _prefix_upper_bound(prefix) if prefix else None
+    if upper is not None:
+        query = query.where(models.Object.name < upper)
+    query = query.where(models.Object.name > after if after is not None else models.Object.name >= prefix)
+    rows = await db.scalars(query.order_by(asc(models.Object.name)).limit(limit))
+    return [_object_info(db_object) for db_object in rows]
+
+def _prefix_upper_bound(prefix: str) -> str | None:
+    """
+    Returns the smallest string that sorts after every string starting with
+    prefix, or None if no such string exists. Used to seek past a whole subtree
+    of keys in the (bucket_id, name) index.
+    """
+    while prefix:
+        code_point = ord(prefix[-1]) + 1
+        if 0xD800 <= code_point <= 0xDFFF:
+            # Surrogates cannot be stored; the next valid code point is U+E000
+            code_point = 0xE000
+        if code_point <= 0x10FFFF:
+            return prefix[:-1] + chr(code_point)
+        prefix = prefix[:-1]
+    return None
+
+class InvalidContinuationToken(ValueError):
+    """Raised for continuation tokens that are malformed or belong to another listing."""
+
+def encode_continuation_token(next_marker: str, prefix: str, delimiter: str | None) -> str:
+    """
+    Packs the position to resume from, together with the listing parameters it
+    is valid for, into an opaque URL-safe token.
+    """
+    payload = json.dumps({"k": next_marker, "p": prefix, "d": delimiter}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_continuation_token(token: str, prefix: str, delimiter: str | None) -> str:
+    """Returns the marker carried by a token issued for the same prefix and delimiter."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        marker = payload["k"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidContinuationToken("The continuation token provided is incorrect.")
+    if not isinstance(marker, str) or payload.get("p") != prefix or payload.get("d") != delimiter:
+        raise InvalidContinuationToken("The continuation token provided is incorrect.")
+    return marker
+
+class ObjectListing:
+    """
+    Lazily lists objects in a bucket with pagination, rolling keys that contain
+    the delimiter after the prefix up into common prefixes. Instead of scanning
+    and grouping every key below a common prefix, the listing re-seeks the index
+    to the first key after that subtree, so the rows read stay proportional to
+    the entries returned. Objects and common prefixes both count towards limit.
+
+    Iterating (async for) yields models.Object rows and common prefix strings in
+    key order, straight from a server-side cursor; is_truncated and next_marker
+    are set once iteration finishes.
+    """
+
+    def __init__(self, db: AsyncSession, bucket_id: int, prefix: str, marker: str, limit: int, delimiter: str = None, start_after: str = None):
+        self.db = db
+        self.bucket_id = bucket_id
+        self.prefix = prefix
+        self.marker = marker
+        self.limit = limit
+        self.delimiter = delimiter
+        self.start_after = start_after
+        self.is_truncated = False
+        self.next_marker = None
+
+    def _start_position(self) -> tuple[str | None, bool]:
+        """Lower bound of the first index seek, and whether it is inclusive."""
+        lower, inclusive = self.prefix, True
+        if self.start_after and self.start_after >= lower:
+            lower, inclusive = self.start_after, False
+        if self.marker and self.marker >= lower:
+            lower, inclusive = self.marker, False
+            if self.delimiter:
+                # A marker inside a common prefix means that prefix was already returned
+                idx = self.marker.find(self.delimiter, len(self.prefix))
+                if idx != -1:
+                    lower, inclusive = _prefix_upper_bound(self.marker[:idx + len(self.delimiter)]), True
+        return lower, inclusive
+
+    async def __aiter__(self):
+        if not self.limit:
+            return  # As in S3, max-keys=0 lists nothing and is not truncated
+        lower, inclusive = self._start_position()
+        # The prefix is applied as an index range scan rather than a LIKE pattern
+        upper = _prefix_upper_bound(self.prefix) if self.prefix else None
+        count = 0
+
+        while lower is not None:
+            query = select(models.Object).where(models.Object.bucket_id == self.bucket_id)
+            if upper is not None:
+                query = query.where(models.Object.name < upper)
+            query = query.where(models.Object.name >= lower if inclusive else models.Object.name > lower)
+            # Rows are streamed in small batches so a re-seek wastes at most one batch
+            rows = await self.db.stream_scalars(query.order_by(asc(models.Object.name)), execution_options={"yield_per": LIST_FETCH_SIZE})
+
+            reseek = False
+            try:
+                async for obj in rows:
+                    if count == self.limit:
+                        self.is_truncated = True
+                        break
+                    count += 1
+                    if self.delimiter:
+                        idx = obj.name.find(self.delimiter, len(self.prefix))
+                        if idx != -1:
+                            common_prefix = obj.name[:idx + len(self.delimiter)]
+                            self.next_marker = common_prefix
+                            lower, inclusive = _prefix_upper_bound(common_prefix), True
+                            reseek = True
+                            yield common_prefix
+                            break
+                    self.next_marker = obj.name
+                    yield obj
+            finally:
+                await rows.close()
+
+            if not reseek:
+                break
+
+        if not self.is_truncated:
+            self.next_marker = None
+
+async def create_bucket(db: AsyncSession, name: str, owner_id: int):
     db_bucket = models.Bucket(name=name, owner_id=owner_id)
     db.add(db_bucket)
-    db.commit()
-    db.refresh(db_bucket)
+    await db.commit()
+    cache.buckets.invalidate(name)
     return db_bucket
 
-def create_object(db: Session, bucket_id: int, name: str, size: int, etag: str, filepath: str, content_type: str):
-    db_object = models.Object(
+async def set_bucket_compression(db: AsyncSession, bucket_id: int, compression: str | None):
+    """Sets the algorithm objects written to a bucket from now on are compressed with."""
+    db_bucket = await db.get(models.Bucket, bucket_id)
+    db_bucket.compression = compression
+    await db.commit()
+    cache.buckets.invalidate(db_bucket.name)
+
+# Request-path metadata writes below do not commit: they are applied through
+# batching.batcher, which runs them on its own synchronous session and commits
+# many of them in one transaction. They use
+# Core statements or flush explicitly, so writes later in the same batch see them.
+
+def _write_objects(db: Session, bucket_id: int, rows: list[dict]) -> dict[str, str]:
+    """
+    Writes object rows of one bucket and returns the file path each replaced,
+    by key; new keys are left out. New keys are inserted with ON CONFLICT DO
+    NOTHING, then existing ones are locked with SELECT ... FOR UPDATE before
+    their current path is read and overwritten. Concurrent writers of a key
+    (e.g. several server processes on PostgreSQL) are thus serialised, and
+    each sees the version it actually replaces: a blob is never released twice
+    and no writer's file is overwritten without being reported.
+    """
+    dialect_name = db.get_bind().dialect.name
+    rows = sorted(rows, key=lambda row: row["name"])  # Lock rows in one order across writers
+    replaced = {}
+    while rows:
+        created = set(db.execute(_insert_new_object_stmt(dialect_name), rows).scalars())
+        rows = [row for row in rows if row["name"] not in created]
+        if not rows:
+            break
+        locked = dict(db.execute(
+            select(models.Object.name, models.Object.filepath)
+            .where(models.Object.bucket_id == bucket_id, models.Object.name.in_([row["name"] for row in rows]))
+            .order_by(models.Object.name)
+            .with_for_update()
+        ).all())
+        existing = [row for row in rows if row["name"] in locked]
+        if existing:
+            db.execute(_upsert_object_stmt(dialect_name), existing)
+        replaced.update(locked)
+        # Keys deleted since the insert was attempted are inserted again
+        rows = [row for row in rows if row["name"] not in locked]
+    return replaced
+
+def upsert_object(
+    db: Session,
+    bucket_id: int,
+    name: str,
+    size: int,
+    etag: str,
+    filepath: str,
+    content_type: str,
+    part_sizes: list[int] | None = None,
+    data: bytes | None = None,
+    compression: str | None = None,
+    stored_size: int | None = None,
+):
+    """
+    Creates the object record for (bucket_id, name), or replaces it in place if the
+    key already exists (see _write_objects).
+    Inline objects pass their contents as data and an empty filepath; compressed
+    files pass their algorithm and the size of the file as stored_size.
+    Returns the last-modified time that was recorded and the file path of the
+    replaced version if it lived elsewhere, for the caller to delete.
+    """
+    values = dict(
         bucket_id=bucket_id,
         name=name,
         size=size,
         etag=etag,
         filepath=filepath,
-        content_type=content_type
+        content_type=content_type,
+        last_modified=datetime.utcnow(),
+        part_sizes=",".join(map(str, part_sizes)) if part_sizes else None,
+        data=data,
+        compression=compression,
+        stored_size=stored_size,
+    )
+    previous = _write_objects(db, bucket_id, [values]).get(name)
+    if previous:
+        _release_blobs(db, [previous])
+    replaced = previous if previous and previous != filepath else None
+    return values["last_modified"], replaced
+
+def upsert_objects(db: Session, bucket_id: int, objects: list[dict]) -> list[str]:
+    """
+    Bulk variant of upsert_object for many keys of one bucket: new keys are
+    created with one multi-row insert, and the versions being replaced are
+    locked, looked up and overwritten with one query each. objects holds upsert_object's keyword arguments, minus
+    bucket_id and part_sizes; if a key appears more than once the last entry
+    wins. Returns the file paths of the replaced versions, for the caller to delete.
+    """
+    now = datetime.utcnow()
+    rows = {}
+    superseded = []
+    for fields in objects:
+        if fields["name"] in rows:
+            superseded.append(rows[fields["name"]]["filepath"])
+        rows[fields["name"]] = dict(
+            bucket_id=bucket_id,
+            name=fields["name"],
+            size=fields["size"],
+            etag=fields["etag"],
+            filepath=fields["filepath"],
+            content_type=fields["content_type"],
+            last_modified=now,
+            part_sizes=None,
+            data=fields.get("data"),
+            compression=fields.get("compression"),
+            stored_size=fields.get("stored_size"),
+        )
+    if not rows:
+        return []
+    previous = _write_objects(db, bucket_id, list(rows.values()))
+    stale = [filepath for filepath in (*previous.values(), *superseded) if filepath]
+    _release_blobs(db, stale)
+    current = {row["filepath"] for row in rows.values()}
+    return [filepath for filepath in stale if filepath not in current]
+
+def acquire_blob(db: Session, filepath: str, size: int):
+    """
+    Takes a reference on a content-addressed blob, registering it if it is new.
+    Callers wait for the commit so the garbage collector sees the reference
+    before the blob's data is placed or shared.
+    """
+    stmt = _insert(db)(models.Blob).values(filepath=filepath, size=size, refcount=1, released_at=None)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Blob.filepath],
+        set_={"refcount": models.Blob.refcount + 1, "released_at": None},
     )
-    db.add(db_object)
+    db.execute(stmt)
+
+def _release_blobs(db: Session, filepaths: list[str]):
+    """
+    Drops one reference per entry of filepaths as part of the caller's transaction.
+    Paths that are not blobs match no row and are ignored.
+    """
+    now = datetime.utcnow()
+    # One statement per distinct number of references dropped, usually just one
+    by_count = {}
+    for filepath, count in Counter(filepaths).items():
+        by_count.setdefault(count, []).append(filepath)
+    for count, paths in by_count.items():
+        db.execute(
+            update(models.Blob)
+            .where(models.Blob.filepath.in_(paths))
+            .values(refcount=models.Blob.refcount - count, released_at=now)
+        )
+
+def release_blobs(db: Session, filepaths: list[str]):
+    """Drops the references that acquire_blob() took for blobs no object ended up using."""
+    _release_blobs(db, filepaths)
+
+def reclaim_blobs(db: Session, released_before: datetime, remove_file: Callable[[str], None]) -> int:
+    """
+    Deletes blobs that have had no references since before released_before and
+    removes their files. The files are removed before the transaction commits,
+    so a concurrent acquire_blob() either wins and keeps the blob alive, or
+    waits and then registers the blob anew. Returns the number of blobs removed.
+    """
+    filepaths = db.execute(
+        delete(models.Blob)
+        .where(models.Blob.refcount <= 0, models.Blob.released_at < released_before)
+        .returning(models.Blob.filepath)
+    ).scalars().all()
+    for filepath in filepaths:
+        remove_file(filepath)
     db.commit()
-    db.refresh(db_object)
-    return db_object
+    return len(filepaths)
 
 def create_multipart_upload(db: Session, upload_id: str, bucket_name: str, object_name: str):
-    upload = models.MultipartUpload(id=upload_id, bucket_name=bucket_name, object_name=object_name)
-    db.add(upload)
-    db.commit()
-    db.refresh(upload)
-    return upload
+    db.add(models.MultipartUpload(id=upload_id, bucket_name=bucket_name, object_name=object_name))
+    db.flush()
 
-def get_multipart_upload(db: Session, upload_id: str):
-    return db.query(models.MultipartUpload).filter(models.MultipartUpload.id == upload_id).first()
+async def get_multipart_upload(db: AsyncSession, upload_id: str):
+    return await db.get(models.MultipartUpload, upload_id)
 
-def create_multipart_part(db: Session, upload_id: str, part_number: int, etag: str, filepath: str):
-    part = models.MultipartPart(upload_id=upload_id, part_number=part_number, etag=etag, filepath=filepath)
-    db.add(part)
-    db.commit()
-    db.refresh(part)
-    return part
+async def get_multipart_parts(db: AsyncSession, upload_id: str):
+    """Returns the uploaded parts of a multipart upload, ordered by part number."""
+    return (await db.scalars(select(models.MultipartPart).where(
+        models.MultipartPart.upload_id == upload_id
+    ).order_by(asc(models.MultipartPart.part_number)))).all()
+
+def upsert_multipart_part(db: Session, upload_id: str, part_number: int, etag: str, filepath: str, size: int) -> tuple[bool, str | None]:
+    """
+    Records an uploaded part, replacing any earlier upload of the same part
+    number. The upload's row is locked first, so a part can't be recorded for
+    an upload that is being (or has been) completed or aborted. Returns whether
+    the part was recorded, and the replaced part's file, which the caller
+    deletes once the write has committed.
+    """
+    upload = db.execute(
+        select(models.MultipartUpload.id).where(models.MultipartUpload.id == upload_id).with_for_update()
+    ).scalar_one_or_none()
+    if upload is None:
+        return False, None
+    previous = db.execute(
+        select(models.MultipartPart.filepath).where(
+            models.MultipartPart.upload_id == upload_id, models.MultipartPart.part_number == part_number
+        ).with_for_update()
+    ).scalar_one_or_none()
+    db.execute(
+        _upsert_part_stmt(db.get_bind().dialect.name),
+        {"upload_id": upload_id, "part_number": part_number, "etag": etag, "filepath": filepath, "size": size},
+    )
+    return True, previous if previous != filepath else None
 
 def delete_multipart_upload(db: Session, upload_id: str):
-    upload = get_multipart_upload(db, upload_id)
-    if upload:
-        db.delete(upload)
-        db.commit()
+    db.execute(delete(models.MultipartPart).where(models.MultipartPart.upload_id == upload_id))
+    db.execute(delete(models.MultipartUpload).where(models.MultipartUpload.id == upload_id))
 
 def delete_object(db: Session, object_id: int):
     """Deletes an object record from the database by its ID."""
-    db_object = db.query(models.Object).filter(models.Object.id == object_id).first()
-    if db_object:
-        db.delete(db_object)
-        db.commit()
-def delete_bucket(db: Session, bucket_id: int):
+    filepaths = db.execute(
+        delete(models.Object).where(models.Object.id == object_id).returning(models.Object.filepath)
+    ).scalars().all()
+    _release_blobs(db, filepaths)
+
+def get_objects_after(db: Session, after_id: int, limit: int):
+    """Returns up to limit objects with an ID above after_id, in ID order, for batch jobs."""
+    return db.query(models.Object).filter(models.Object.id > after_id).order_by(asc(models.Object.id)).limit(limit).all()
+
+def relocate_object(db: Session, db_object: models.Object, filepath: str, blob: bool = False):
+    """
+    Points an object at a new copy of its data, moving its blob reference
+    along with it. The caller commits, then deletes the old file.
+    """
+    if blob:
+        acquire_blob(db, filepath, db_object.stored_size or db_object.size)
+    _release_blobs(db, [db_object.filepath])
+    db_object.filepath = filepath
+
+async def get_objects_by_names(db: AsyncSession, bucket_id: int, names: list[str]):
+    """Resolves many keys of a bucket in a single query."""
+    if not names:
+        return []
+    return (await db.scalars(select(models.Object).where(
+        models.Object.bucket_id == bucket_id,
+        models.Object.name.in_(names)
+    ))).all()
+
+def delete_objects(db: Session, object_ids: list[int]):
+    """Deletes many object records with a single statement."""
+    if object_ids:
+        filepaths = db.execute(
+            delete(models.Object).where(models.Object.id.in_(object_ids)).returning(models.Object.filepath)
+        ).scalars().all()
+        _release_blobs(db, filepaths)
+
+async def delete_bucket(db: AsyncSession, bucket_id: int):
     """Deletes a bucket record from the database by its ID."""
-    db_bucket = db.query(models.Bucket).filter(models.Bucket.id == bucket_id).first()
+    db_bucket = await db.get(models.Bucket, bucket_id)
     if db_bucket:
-        db.delete(db_bucket)
-        db.commit()
\ No newline at end of file
+        await db.delete(db_bucket)
+        await db.commit()
+        cache.buckets.invalidate(db_bucket.name)
\ No newline at end of file
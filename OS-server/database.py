@@ -1,18 +1,83 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./s3_metadata.db"
+import metrics
+from config import DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_SIZE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE
+
+_backend = make_url(DATABASE_URL).get_backend_name()
+is_sqlite = _backend == "sqlite"
+
+# Request handlers use the async engine; the metadata write batcher, schema
+# migrations and offline tools use the synchronous one on the same database.
+# Both drivers are picked by backend, whatever driver DATABASE_URL names.
+SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg2"}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+SYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername=SYNC_DRIVERS[_backend])
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername=ASYNC_DRIVERS[_backend])
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the single writer (also across worker
+    processes), and synchronous=NORMAL only syncs at checkpoints, which is
+    still safe against corruption in WAL mode.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+if is_sqlite:
+    engine = create_engine(
+        SYNC_DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    event.listen(engine, "connect", _configure_sqlite)
+    event.listen(async_engine.sync_engine, "connect", _configure_sqlite)
+else:
+    engine = create_engine(
+        SYNC_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    metrics.add_phase_time("db", time.perf_counter() - conn.info.pop("query_started"))
+
+# Queries issued by request handlers count towards the request's db phase
+event.listen(async_engine.sync_engine, "before_cursor_execute", _start_query_timer)
+event.listen(async_engine.sync_engine, "after_cursor_execute", _stop_query_timer)
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Loaded attributes stay usable after commit, as handlers keep reading results
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Mapping
+
+try:
+    import google_crc32c
+except ImportError:  # Optional: only needed to verify CRC32C checksums
+    google_crc32c = None
+
+# x-amz-content-sha256 values announcing an aws-chunked body (SigV4 streaming uploads)
+STREAMING_SIGNED = "STREAMING-AWS4-HMAC-SHA256-PAYLOAD"
+STREAMING_SIGNED_TRAILER = "STREAMING-AWS4-HMAC-SHA256-PAYLOAD-TRAILER"
+STREAMING_UNSIGNED_TRAILER = "STREAMING-UNSIGNED-PAYLOAD-TRAILER"
+STREAMING_PAYLOADS = (STREAMING_SIGNED, STREAMING_SIGNED_TRAILER, STREAMING_UNSIGNED_TRAILER)
+
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+# Longest chunk header or trailer line accepted in an aws-chunked body
+MAX_CHUNK_LINE = 4096
+
+
+class IntegrityError(Exception):
+    """Raised when a request body is malformed or does not match what the client declared."""
+
+    def __init__(self, code: str, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+
+
+class _CRC32:
+    """hashlib-style wrapper around zlib.crc32."""
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data: bytes):
+        self._crc = zlib.crc32(data, self._crc)
+
+    def digest(self) -> bytes:
+        return self._crc.to_bytes(4, "big")
+
+
+class _CRC32C:
+    """hashlib-style wrapper around google_crc32c, which only accepts bytes."""
+
+    def __init__(self):
+        self._checksum = google_crc32c.Checksum()
+
+    def update(self, data: bytes):
+        self._checksum.update(bytes(data))
+
+    def digest(self) -> bytes:
+        return self._checksum.digest()
+
+
+# Flexible checksum algorithms, keyed by their x-amz-checksum-<name> header suffix
+CHECKSUM_ALGORITHMS = {
+    "crc32": _CRC32,
+    "crc32c": _CRC32C,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+}
+
+
+@dataclass
+class PayloadChecks:
+    """
+    Digests a client declared for a request body. They are all verified in the
+    same pass that writes the body to disk (see storage.ObjectWriter).
+    """
+    sha256: str | None = None  # Hex digest from x-amz-content-sha256
+    md5: str | None = None  # Hex digest from Content-MD5
+    checksum_algorithm: str | None = None  # Flexible checksum, e.g. "crc32c"
+    checksum: str | None = None  # Base64 value from its header, or from the trailer of an aws-chunked body
+    decoded_length: int | None = None  # x-amz-decoded-content-length of an aws-chunked body
+    computed_checksum: str | None = None  # Set once the body has been verified
+
+    def new_checksum(self):
+        """Returns a fresh hasher for the flexible checksum, if one was requested."""
+        return CHECKSUM_ALGORITHMS[self.checksum_algorithm]() if self.checksum_algorithm else None
+
+    def verify(self, md5, sha256, checksum):
+        """Compares the finished hashers against the declared digests."""
+        if self.sha256 and sha256.hexdigest() != self.sha256:
+            raise IntegrityError("XAmzContentSHA256Mismatch", "The provided 'x-amz-content-sha256' header does not match what was computed.")
+        if self.md5 and md5.hexdigest() != self.md5:
+            raise IntegrityError("BadDigest", "The Content-MD5 you specified did not match what we received.")
+        if checksum is not None:
+            self.computed_checksum = base64.b64encode(checksum.digest()).decode()
+            if self.checksum is None:
+                raise IntegrityError("InvalidRequest", f"The x-amz-checksum-{self.checksum_algorithm} value was not sent.")
+            if self.computed_checksum != self.checksum:
+                raise IntegrityError("BadDigest", f"The {self.checksum_algorithm.upper()} you specified did not match the calculated checksum.")
+
+
+def payload_checks(headers: Mapping[str, str]) -> PayloadChecks:
+    """Collects the digests declared in the request headers."""
+    checks = PayloadChecks()
+
+    payload_hash = headers.get("x-amz-content-sha256", "").lower()
+    if len(payload_hash) == 64 and all(c in "0123456789abcdef" for c in payload_hash):
+        checks.sha256 = payload_hash
+
+    content_md5 = headers.get("content-md5")
+    if content_md5 is not None:
+        try:
+            digest = base64.b64decode(content_md5, validate=True)
+        except binascii.Error:
+            digest = b""
+        if len(digest) != 16:
+            raise IntegrityError("InvalidDigest", "The Content-MD5 you specified is not valid.")
+        checks.md5 = digest.hex()
+
+    declared = [name for name in CHECKSUM_ALGORITHMS if f"x-amz-checksum-{name}" in headers]
+    trailer = headers.get("x-amz-trailer", "").strip().lower()
+    if trailer.startswith("x-amz-checksum-"):
+        declared.append(trailer.removeprefix("x-amz-checksum-"))
+    if len(declared) > 1:
+        raise IntegrityError("InvalidRequest", "Expecting a single x-amz-checksum- header. Multiple checksum Types are not allowed.")
+    if declared:
+        algorithm = declared[0]
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise IntegrityError("InvalidRequest", f"Checksum algorithm '{algorithm}' is not supported.")
+        if algorithm == "crc32c" and google_crc32c is None:
+            raise IntegrityError("NotImplemented", "CRC32C checksums need the google-crc32c package on the server.", status_code=501)
+        checks.checksum_algorithm = algorithm
+        checks.checksum = headers.get(f"x-amz-checksum-{algorithm}")
+
+    if headers.get("x-amz-decoded-content-length") is not None:
+        try:
+            checks.decoded_length = int(headers["x-amz-decoded-content-length"])
+        except ValueError:
+            raise IntegrityError("InvalidArgument", "x-amz-decoded-content-length is not a number.")
+    return checks
+
+
+def verify_body(checks: PayloadChecks, body: bytes) -> str:
+    """Verifies a small request body that was read into memory in one piece. Returns its MD5 hex digest."""
+    md5, sha256, checksum = hashlib.md5(body), hashlib.sha256(body), checks.new_checksum()
+    if checksum is not None:
+        checksum.update(body)
+    checks.verify(md5, sha256, checksum)
+    return md5.hexdigest()
+
+
+class ChunkSigner:
+    """
+    Verifies the signature chain of a signed aws-chunked body. Every chunk is
+    signed over the previous chunk's signature, starting from the signature of
+    the request headers (the seed), so chunks can't be dropped or reordered.
+    """
+
+    def __init__(self, signing_key: bytes, seed_signature: str, amz_date: str, scope: str):
+        self.signing_key = signing_key
+        self.previous_signature = seed_signature
+        self.amz_date = amz_date
+        self.scope = scope
+
+    def _verify(self, algorithm: str, signature: str | None, payload_hash: str, extra: tuple[str, ...] = ()):
+        string_to_sign = "\n".join((algorithm, self.amz_date, self.scope, self.previous_signature, *extra, payload_hash))
+        expected = hmac.new(self.signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        if not signature or not hmac.compare_digest(expected, signature):
+            raise IntegrityError("SignatureDoesNotMatch", "The chunk signature we calculated does not match the signature you provided.", status_code=403)
+        self.previous_signature = signature
+
+    def verify_chunk(self, signature: str | None, chunk_sha256: str):
+        self._verify("AWS4-HMAC-SHA256-PAYLOAD", signature, chunk_sha256, extra=(EMPTY_SHA256,))
+
+    def verify_trailer(self, signature: str | None, trailer: bytes):
+        self._verify("AWS4-HMAC-SHA256-TRAILER", signature, hashlib.sha256(trailer).hexdigest())
+
+
+async def decode_aws_chunked(stream: AsyncIterator[bytes], checks: PayloadChecks, signer: ChunkSigner | None = None) -> AsyncIterator[bytes]:
+    """
+    Strips the aws-chunked framing from a streaming upload and yields the data.
+    Chunk signatures are checked against signer and trailing checksums are
+    stored in checks. Data is yielded before its chunk's signature is
+    verified; a failure raises IntegrityError, which aborts the upload before
+    anything becomes visible.
+    """
+    buffer = bytearray()
+    stream = aiter(stream)
+
+    async def fill() -> bool:
+        try:
+            buffer.extend(await anext(stream))
+            return True
+        except StopAsyncIteration:
+            return False
+
+    async def read_line(eof_ok: bool = False) -> bytes | None:
+        while (end := buffer.find(b"\r\n")) == -1:
+            if len(buffer) > MAX_CHUNK_LINE:
+                raise IntegrityError("InvalidRequest", "Malformed aws-chunked encoding.")
+            if not await fill():
+                if eof_ok and not buffer:
+                    return None
+                raise IntegrityError("IncompleteBody", "The request body terminated unexpectedly.")
+        line = bytes(buffer[:end])
+        del buffer[:end + 2]
+        return line
+
+    decoded = 0
+    while True:
+        size_field, _, extension = (await read_line()).decode("latin-1").partition(";")
+        try:
+            size = int(size_field, 16)
+        except ValueError:
+            raise IntegrityError("InvalidRequest", "Malformed aws-chunked encoding.")
+        if checks.decoded_length is not None and decoded + size > checks.decoded_length:
+            # Refuse the excess before reading it, rather than at the end of the body
+            raise IntegrityError("IncompleteBody", "You did not provide the number of bytes specified by the x-amz-decoded-content-length header.")
+        chunk_hash = hashlib.sha256() if signer else None
+        remaining = size
+        while remaining:
+            if not buffer and not await fill():
+                raise IntegrityError("IncompleteBody", "The request body terminated unexpectedly.")
+            piece = bytes(buffer[:remaining])
+            del buffer[:len(piece)]
+            remaining -= len(piece)
+            if chunk_hash:
+                chunk_hash.update(piece)
+            yield piece
+        if signer:
+            signer.verify_chunk(extension.partition("chunk-signature=")[2] or None, chunk_hash.hexdigest())
+        decoded += size
+        if size == 0:
+            break
+        if await read_line() != b"":
+            raise IntegrityError("InvalidRequest", "Malformed aws-chunked encoding.")
+
+    # Optional trailing headers, ended by an empty line
+    trailer = []
+    trailer_signature = None
+    while line := await read_line(eof_ok=True):
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip()
+        if name == "x-amz-trailer-signature":
+            trailer_signature = value
+        else:
+            trailer.append(f"{name}:{value}\n")
+            if name == f"x-amz-checksum-{checks.checksum_algorithm}":
+                checks.checksum = value
+    if signer and trailer:
+        signer.verify_trailer(trailer_signature, "".join(trailer).encode())
+
+    if checks.decoded_length is not None and decoded != checks.decoded_length:
+        raise IntegrityError("IncompleteBody", "You did not provide the number of bytes specified by the x-amz-decoded-content-length header.")
@@ -1,26 +1,53 @@
+import asyncio
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
+import cache
 import crud
+import maintenance
+import metrics
+import migrations
 import models
-from database import SessionLocal, engine
+import workers
+from batching import batcher
+from database import AsyncSessionLocal, async_engine, engine
 from router import router
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Create DB tables
-models.Base.metadata.create_all(bind=engine)
+# Create DB tables and upgrade databases created by older versions
+migrations.run_migrations(engine)
 
 app = FastAPI()
 
+def sample_saturation():
+    """Updates the gauges for the I/O thread pool, the DB connection pool and the write queue."""
+    io_pool = workers.pool_stats()
+    metrics.IO_POOL_ACTIVE.set(io_pool["active"])
+    metrics.IO_POOL_QUEUED.set(io_pool["queued"])
+    metrics.DB_POOL_CHECKED_OUT.set(async_engine.pool.checkedout())
+    metrics.DB_POOL_OVERFLOW.set(max(async_engine.pool.overflow(), 0))
+    metrics.WRITE_QUEUE_DEPTH.set(batcher.pending())
+    metrics.OBJECT_CACHE_BYTES.set(cache.objects.size)
+
+app.add_middleware(metrics.MetricsMiddleware, sample=sample_saturation)
+
+# Registered before the router, whose /{bucket_name} routes would otherwise match it
+@app.get("/metrics")
+def read_metrics():
+    sample_saturation()
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
 # Include the main router
 app.include_router(router)
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     # Get credentials from environment variables
     default_access_key = os.getenv("MINIO_ACCESS_KEY")
     default_secret_key = os.getenv("MINIO_SECRET_KEY")
@@ -30,23 +57,43 @@ def startup_event():
         return
 
     # Create a default user for testing if it doesn't exist
-    db = SessionLocal()
-    user = crud.get_user_by_access_key(db, default_access_key)
-    if not user:
-        default_user = models.User(
-            access_key=default_access_key,
-            secret_key=default_secret_key
-        )
-        db.add(default_user)
-        db.commit()
-        db.refresh(default_user)
-    db.close()
+    async with AsyncSessionLocal() as db:
+        user = await crud.get_user_by_access_key(db, default_access_key)
+        if not user:
+            default_user = models.User(
+                access_key=default_access_key,
+                secret_key=default_secret_key
+            )
+            db.add(default_user)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another worker created it first
+                await db.rollback()
     
     print("\nServer is ready.")
     print("Default credentials for Minio Client loaded from .env file:")
     print(f"  Access Key: {default_access_key}")
     print(f"  Secret Key: {default_secret_key}\n") # Mask the secret key for security
 
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.blob_gc = asyncio.create_task(maintenance.run_blob_gc())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.blob_gc.cancel()
+    # Let in-flight disk and database work finish before the process exits
+    workers.executor.shutdown(wait=True)
+    batcher.close()
+    await async_engine.dispose()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        metrics.multiprocess.mark_process_dead(os.getpid())
+
 @app.get("/")
 def read_root():
-    return {"message": "MinIO Compatible FastAPI Server is running."}
+    return {
+        "message": "MinIO Compatible FastAPI Server is running.",
+        "io_pool": workers.pool_stats(),
+        "object_cache": cache.objects.stats(),
+    }
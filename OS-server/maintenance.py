@@ -0,0 +1,31 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import crud
+import storage
+from config import BLOB_GC_GRACE_SECONDS, BLOB_GC_INTERVAL_SECONDS
+from database import SessionLocal
+from workers import run_blocking
+
+def collect_blob_garbage() -> int:
+    """
+    Removes content-addressed blobs that no object has referenced for at least
+    BLOB_GC_GRACE_SECONDS. Returns the number of blobs removed.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+        return crud.reclaim_blobs(db, cutoff, storage.delete_blob)
+    finally:
+        db.close()
+
+async def run_blob_gc():
+    """Background task that periodically collects unreferenced blobs."""
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        try:
+            removed = await run_blocking(collect_blob_garbage)
+            if removed:
+                print(f"Blob GC removed {removed} unreferenced blob(s)")
+        except Exception as e:
+            print(f"Error collecting unreferenced blobs: {e}")
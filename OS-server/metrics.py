@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import ACCESS_LOG
+
+# Phases a request's latency is broken down into. Time spent outside them
+# (network transfer, request parsing, XML rendering) shows up only in the total.
+PHASES = ("auth", "db", "disk")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUESTS = Counter("s3_requests_total", "Requests handled, by S3 operation and HTTP status.", ["operation", "status"])
+REQUEST_LATENCY = Histogram("s3_request_duration_seconds", "Time from receiving a request to sending the last byte of its response.", ["operation"], buckets=LATENCY_BUCKETS)
+PHASE_LATENCY = Histogram("s3_request_phase_duration_seconds", "Time a request spent in each phase.", ["operation", "phase"], buckets=LATENCY_BUCKETS)
+BYTES_RECEIVED = Counter("s3_request_bytes_total", "Request body bytes received.", ["operation"])
+BYTES_SENT = Counter("s3_response_bytes_total", "Response body bytes sent.", ["operation"])
+IN_FLIGHT = Gauge("s3_requests_in_flight", "Requests currently being handled.", multiprocess_mode="livesum")
+
+IO_POOL_ACTIVE = Gauge("s3_io_pool_active_threads", "I/O thread pool threads running a task.", multiprocess_mode="livesum")
+IO_POOL_QUEUED = Gauge("s3_io_pool_queued_tasks", "Tasks waiting for a free I/O thread.", multiprocess_mode="livesum")
+DB_POOL_CHECKED_OUT = Gauge("s3_db_pool_checked_out_connections", "Metadata database connections in use by requests.", multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge("s3_db_pool_overflow_connections", "Connections opened beyond DB_POOL_SIZE.", multiprocess_mode="livesum")
+OBJECT_CACHE_HITS = Counter("s3_object_cache_hits_total", "Object lookups answered by the object cache.")
+OBJECT_CACHE_MISSES = Counter("s3_object_cache_misses_total", "Object lookups that had to query the database.")
+OBJECT_CACHE_EVICTIONS = Counter("s3_object_cache_evictions_total", "Entries evicted from the object cache to stay within its byte limit.")
+OBJECT_CACHE_BYTES = Gauge("s3_object_cache_bytes", "Bytes held by the object cache.", multiprocess_mode="livesum")
+WRITE_QUEUE_DEPTH = Gauge("s3_write_batch_queued_writes", "Metadata writes waiting for the write batcher.", multiprocess_mode="livesum")
+
+access_log = logging.getLogger("s3.access")
+if ACCESS_LOG:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    access_log.addHandler(_handler)
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+
+# Seconds spent per phase by the current request, and the phase being timed
+_phase_times: ContextVar[dict | None] = ContextVar("phase_times", default=None)
+_current_phase: ContextVar[str | None] = ContextVar("current_phase", default=None)
+
+
+def add_phase_time(name: str, seconds: float):
+    """Charges time to a phase of the current request, unless a phase is already being timed."""
+    times = _phase_times.get()
+    if times is not None and _current_phase.get() is None:
+        times[name] = times.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Times the enclosed block as a phase of the current request. Phases don't
+    nest: work inside a phase (e.g. the user lookup during auth) is charged
+    to the outer one, so the phases of a request never add up to more than
+    its wall time, except for work it runs concurrently.
+    """
+    if _phase_times.get() is None or _current_phase.get() is not None:
+        yield
+        return
+    token = _current_phase.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_phase.reset(token)
+        add_phase_time(name, time.perf_counter() - start)
+
+
+def operation_name(method: str, path: str, query: dict, headers: dict) -> str:
+    """Maps a request to its S3 operation name, which keeps metric labels bounded."""
+    bucket, _, key = path.lstrip("/").partition("/")
+    if not bucket:
+        return "ListBuckets" if method == "GET" else "Unknown"
+    if not key:
+        if method == "GET":
+            if "location" in query:
+                return "GetBucketLocation"
+            if "archive" in query:
+                return "GetArchive"
+            if "compression" in query:
+                return "GetBucketCompression"
+            return "ListObjectsV2" if query.get("list-type") == ["2"] else "ListObjects"
+        if method == "PUT" and "compression" in query:
+            return "PutBucketCompression"
+        return {"HEAD": "HeadBucket", "PUT": "CreateBucket", "DELETE": "DeleteBucket", "POST": "DeleteObjects"}.get(method, "Unknown")
+    copy = b"x-amz-copy-source" in headers
+    if method == "PUT":
+        if "uploadId" in query:
+            return "UploadPartCopy" if copy else "UploadPart"
+        if b"x-amz-meta-snowball-auto-extract" in headers:
+            return "ExtractArchive"
+        return "CopyObject" if copy else "PutObject"
+    if method == "POST":
+        return "CreateMultipartUpload" if "uploads" in query else "CompleteMultipartUpload"
+    if method == "DELETE":
+        return "AbortMultipartUpload" if "uploadId" in query else "DeleteObject"
+    return {"GET": "GetObject", "HEAD": "HeadObject"}.get(method, "Unknown")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records request metrics and writes one JSON access
+    log line per request. It wraps receive/send instead of the response, so
+    streamed bodies are neither buffered nor cut short.
+    """
+
+    def __init__(self, app: ASGIApp, sample=None, skip_paths: tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.sample = sample
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        operation = operation_name(scope["method"], scope["path"], parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True), headers)
+        times = {}
+        received = sent = 0
+        status = 500
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message: Message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        token = _phase_times.set(times)
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            _phase_times.reset(token)
+            REQUESTS.labels(operation, str(status)).inc()
+            REQUEST_LATENCY.labels(operation).observe(elapsed)
+            for name in PHASES:
+                PHASE_LATENCY.labels(operation, name).observe(times.get(name, 0.0))
+            BYTES_RECEIVED.labels(operation).inc(received)
+            BYTES_SENT.labels(operation).inc(sent)
+            if self.sample:
+                self.sample()
+            if ACCESS_LOG:
+                client = scope.get("client")
+                access_log.info(json.dumps({
+                    "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                    "remote": client[0] if client else None,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope["query_string"].decode("latin-1"),
+                    "operation": operation,
+                    "status": status,
+                    "bytes_in": received,
+                    "bytes_out": sent,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    **{f"{name}_ms": round(times.get(name, 0.0) * 1000, 3) for name in PHASES},
+                    "user_agent": headers.get(b"user-agent", b"").decode("latin-1"),
+                }))
+
+
+def render() -> tuple[bytes, str]:
+    """Returns the metrics in the Prometheus text format, with their content type."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Several worker processes: merge the values each of them wrote to disk
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,86 @@
+"""
+Offline migration of stored object data to another on-disk layout.
+
+Stop the server first, then run this from the server's working directory
+(where s3_metadata.db and s3_storage/ live), e.g.:
+
+    python /path/to/OS-server/migrate_layout.py --to sharded
+
+Each object's data is hard-linked to its new location, the new path is
+committed to the database, and only then is the old file removed, so an
+interrupted run can simply be started again.
+"""
+import argparse
+import os
+from pathlib import Path
+
+import crud
+import models
+import storage
+from config import STORAGE_LAYOUT
+from database import SessionLocal
+
+# Objects moved per database transaction
+BATCH_SIZE = 500
+
+def _target_path(layout, bucket_name: str, db_object: models.Object) -> Path | None:
+    """Returns where the object's data belongs in the target layout, or None if it is already there."""
+    current = Path(db_object.filepath)
+    if layout.content_addressed:
+        return None if storage.is_blob_path(db_object.filepath) else storage.blob_path(storage.data_sha256(db_object.filepath, db_object.compression), db_object.compression)
+    if isinstance(layout, storage.ShardedLayout):
+        return None if current.is_relative_to(layout.root) else layout.object_path(bucket_name, db_object.name)
+    target = layout.object_path(bucket_name, db_object.name)
+    return None if current == target else target
+
+def _remove_empty_dirs(root: Path):
+    """Removes directories below root that were left empty."""
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if Path(dirpath) != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+def migrate(layout_name: str) -> int:
+    """Moves every object that is not yet stored in the given layout. Returns the number moved."""
+    layout = storage.LAYOUTS[layout_name]()
+    db = SessionLocal()
+    moved = 0
+    try:
+        bucket_names = {bucket.id: bucket.name for bucket in db.query(models.Bucket).all()}
+        last_id = 0
+        while batch := crud.get_objects_after(db, last_id, BATCH_SIZE):
+            last_id = batch[-1].id
+            old_paths = []
+            for db_object in batch:
+                if storage.is_inline(db_object.filepath):
+                    continue  # Stored in the database, not on disk
+                if not os.path.exists(db_object.filepath):
+                    print(f"Skipping {bucket_names[db_object.bucket_id]}/{db_object.name}: {db_object.filepath} is missing")
+                    continue
+                target = _target_path(layout, bucket_names[db_object.bucket_id], db_object)
+                if target is None:
+                    continue
+                if not (layout.content_addressed and target.exists()):
+                    storage.link_into_place(db_object.filepath, target)
+                old_paths.append(db_object.filepath)
+                crud.relocate_object(db, db_object, str(target), blob=layout.content_addressed)
+            db.commit()
+            for old_path in old_paths:
+                storage.delete_object(old_path)
+            moved += len(old_paths)
+            print(f"Migrated {moved} objects")
+        if not isinstance(layout, storage.PathLayout):
+            for bucket_name in bucket_names.values():
+                _remove_empty_dirs(storage.STORAGE_ROOT / bucket_name)
+    finally:
+        db.close()
+    return moved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move stored object data to another on-disk layout.")
+    parser.add_argument("--to", dest="layout", choices=sorted(storage.LAYOUTS), default=STORAGE_LAYOUT,
+                        help="Target layout (default: STORAGE_LAYOUT, currently %(default)s)")
+    args = parser.parse_args()
+    print(f"Done, {migrate(args.layout)} objects moved to the '{args.layout}' layout.")
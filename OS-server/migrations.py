@@ -0,0 +1,80 @@
+from sqlalchemy import LargeBinary, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+import models
+
+# Arbitrary key of the PostgreSQL advisory lock that serialises schema setup
+_SCHEMA_LOCK_KEY = 0x53335F534348454D
+
+
+def _lock_schema(conn: Connection):
+    """
+    Several workers may start at once against the same database; only one of
+    them at a time may create tables or run migrations. The lock is held until
+    the transaction commits.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK_KEY})
+    elif conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str):
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _ensure_unique_object_keys(conn: Connection):
+    """
+    Older databases allowed several rows for the same (bucket_id, name), one per
+    overwrite. Keep only the newest row of each key, then add the unique index
+    that lets PUT upsert in place. Duplicates shared the same file on disk, so no
+    file cleanup is needed.
+    """
+    indexes = {i["name"] for i in inspect(conn).get_indexes("objects")}
+    if "ix_objects_bucket_id_name" in indexes:
+        return
+    conn.execute(text(
+        "DELETE FROM objects WHERE id NOT IN "
+        "(SELECT MAX(id) FROM objects GROUP BY bucket_id, name)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_objects_name"))
+    conn.execute(text("CREATE UNIQUE INDEX ix_objects_bucket_id_name ON objects (bucket_id, name)"))
+
+
+def _ensure_unique_part_numbers(conn: Connection):
+    """
+    Older databases added a row per upload of a part, so a part number that was
+    uploaded again appears several times. Keep the newest row of each part
+    number, then add the unique index that lets part uploads upsert in place.
+    """
+    indexes = {i["name"] for i in inspect(conn).get_indexes("multipart_parts")}
+    if "ix_multipart_parts_upload_id_part_number" in indexes:
+        return
+    conn.execute(text(
+        "DELETE FROM multipart_parts WHERE id NOT IN "
+        "(SELECT MAX(id) FROM multipart_parts GROUP BY upload_id, part_number)"
+    ))
+    conn.execute(text("CREATE UNIQUE INDEX ix_multipart_parts_upload_id_part_number ON multipart_parts (upload_id, part_number)"))
+
+
+def run_migrations(engine: Engine):
+    """
+    Creates missing tables and brings a metadata database created by an older
+    version of the server up to date with models.py. create_all() only creates
+    missing tables, so columns added to existing tables are applied here. Every
+    step is idempotent and everything runs in one transaction.
+    """
+    with engine.connect() as conn:
+        _lock_schema(conn)
+        models.Base.metadata.create_all(bind=conn)
+        _add_column_if_missing(conn, "objects", "part_sizes", "VARCHAR")
+        _add_column_if_missing(conn, "objects", "data", LargeBinary().compile(dialect=conn.dialect))
+        _add_column_if_missing(conn, "objects", "compression", "VARCHAR")
+        _add_column_if_missing(conn, "objects", "stored_size", "BIGINT")
+        _add_column_if_missing(conn, "buckets", "compression", "VARCHAR")
+        _ensure_unique_object_keys(conn)
+        _add_column_if_missing(conn, "multipart_parts", "size", "BIGINT")
+        _ensure_unique_part_numbers(conn)
+        conn.commit()
@@ -1,8 +1,12 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Boolean, Column, Integer, LargeBinary, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from database import Base
 
+# Object keys compare bytewise, as in S3, so PostgreSQL must not apply a
+# locale-aware collation to them; SQLite already compares bytewise.
+KeyString = String().with_variant(String(collation="C"), "postgresql")
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -16,20 +20,39 @@ class Bucket(Base):
     name = Column(String, unique=True, index=True, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="buckets")
+    compression = Column(String, nullable=True)  # Algorithm new objects are compressed with, or null
     objects = relationship("Object", back_populates="bucket")
 
 class Object(Base):
     __tablename__ = "objects"
+    # A key is unique within its bucket; the composite index also serves ordered listings
+    __table_args__ = (Index("ix_objects_bucket_id_name", "bucket_id", "name", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True, nullable=False)
+    name = Column(KeyString, nullable=False)
     bucket_id = Column(Integer, ForeignKey("buckets.id"))
-    size = Column(Integer, nullable=False)
+    size = Column(BigInteger, nullable=False)
     etag = Column(String, nullable=False)
     filepath = Column(String, nullable=False)
     content_type = Column(String, default="application/octet-stream")
     last_modified = Column(DateTime, default=datetime.utcnow)
+    part_sizes = Column(String, nullable=True)  # Comma-separated part sizes for multipart objects
+    # Contents of a small object stored inline, in which case filepath is empty.
+    # Only loaded when asked for, so listings and HEAD never read it.
+    data = deferred(Column(LargeBinary, nullable=True))
+    # Algorithm the data file is compressed with (see compression.py), or null.
+    # size is always the uncompressed size; stored_size is the size of the file.
+    compression = Column(String, nullable=True)
+    stored_size = Column(BigInteger, nullable=True)
     bucket = relationship("Bucket", back_populates="objects")
 
+class Blob(Base):
+    """A content-addressed data file shared by every object whose filepath points at it."""
+    __tablename__ = "blobs"
+    filepath = Column(String, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    released_at = Column(DateTime, nullable=True, index=True)  # When the last reference was dropped
+
 class MultipartUpload(Base):
     __tablename__ = "multipart_uploads"
     id = Column(String, primary_key=True, index=True)  # This is the upload_id
@@ -40,9 +63,12 @@ class MultipartUpload(Base):
 
 class MultipartPart(Base):
     __tablename__ = "multipart_parts"
+    # Uploading a part number again replaces the earlier upload of that part
+    __table_args__ = (Index("ix_multipart_parts_upload_id_part_number", "upload_id", "part_number", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
     upload_id = Column(String, ForeignKey("multipart_uploads.id"))
     part_number = Column(Integer, nullable=False)
     etag = Column(String, nullable=False)
     filepath = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=True)  # Null for parts recorded by older versions
     upload = relationship("MultipartUpload", back_populates="parts")
\ No newline at end of file
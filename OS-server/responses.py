@@ -1,12 +1,19 @@
+from typing import AsyncIterable, AsyncIterator, Callable
 from xml.etree.ElementTree import Element, SubElement, tostring
-import models
+from xml.sax.saxutils import escape
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+S3_XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+# Listing output is flushed to the client in pieces of roughly this many bytes
+STREAM_FLUSH_SIZE = 64 * 1024
 
 def generate_error_response(code: str, message: str, resource: str) -> bytes:
-    root = Element("Error")
-    SubElement(root, "Code").text = code
-    SubElement(root, "Message").text = message
-    SubElement(root, "Resource").text = resource
-    return tostring(root, encoding="utf-8")
+    return (
+        f"{XML_DECLARATION}<Error><Code>{escape(code)}</Code>"
+        f"<Message>{escape(message)}</Message>"
+        f"<Resource>{escape(resource)}</Resource></Error>"
+    ).encode()
 
 def initiate_multipart_upload_response(bucket: str, key: str, upload_id: str) -> bytes:
     root = Element("InitiateMultipartUploadResult", {"xmlns": "http://s3.amazonaws.com/doc/2006-03-01/"})
@@ -24,39 +31,96 @@ def complete_multipart_upload_response(bucket: str, key: str, etag: str, locatio
     return tostring(root, encoding="utf-8")
 
 
+_LOCATION_RESPONSE = tostring(Element("LocationConstraint", {"xmlns": S3_XMLNS}), encoding="utf-8")
+
 def generate_location_response() -> bytes:
-    """Generates an S3-compatible LocationConstraint XML response."""
-    root = Element("LocationConstraint", {"xmlns": "http://s3.amazonaws.com/doc/2006-03-01/"})
+    """Returns the S3-compatible LocationConstraint XML response, which never changes."""
+    return _LOCATION_RESPONSE
+
+def compression_configuration_response(algorithm: str | None) -> bytes:
+    """Returns a bucket's compression setting; NONE when objects are stored as written."""
+    root = Element("CompressionConfiguration", {"xmlns": S3_XMLNS})
+    SubElement(root, "Algorithm").text = algorithm or "NONE"
     return tostring(root, encoding="utf-8")
 
-def generate_list_objects_v2_response(
+def _element(tag: str, text: str) -> str:
+    return f"<{tag}>{escape(text)}</{tag}>"
+
+def copy_result_response(root_tag: str, etag: str, last_modified) -> bytes:
+    """Generates a CopyObjectResult or CopyPartResult XML response."""
+    return (
+        f'{XML_DECLARATION}<{root_tag} xmlns="{S3_XMLNS}">'
+        f"<LastModified>{last_modified.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}</LastModified>"
+        f"<ETag>&quot;{escape(etag)}&quot;</ETag></{root_tag}>"
+    ).encode()
+
+def delete_result_response(deleted: list[str], errors: list[tuple[str, str, str]], quiet: bool) -> bytes:
+    """Generates an S3-compatible DeleteResult XML response for DeleteObjects."""
+    parts = [XML_DECLARATION, f'<DeleteResult xmlns="{S3_XMLNS}">']
+    if not quiet:
+        parts.extend(f"<Deleted>{_element('Key', key)}</Deleted>" for key in deleted)
+    for key, code, message in errors:
+        parts.append(f"<Error>{_element('Key', key)}{_element('Code', code)}{_element('Message', message)}</Error>")
+    parts.append("</DeleteResult>")
+    return "".join(parts).encode()
+
+async def generate_list_objects_v2_response(
     bucket_name: str,
     prefix: str,
     marker: str,
     max_keys: int,
-    is_truncated: bool,
-    objects: list[models.Object],
-    next_marker: str,
-) -> bytes:
-    """Generates an S3-compatible ListBucketResult (V2) XML response."""
-    root = Element("ListBucketResult", {"xmlns": "http://s3.amazonaws.com/doc/2006-03-01/"})
-    SubElement(root, "Name").text = bucket_name
-    SubElement(root, "Prefix").text = prefix
-    SubElement(root, "MaxKeys").text = str(max_keys)
-    SubElement(root, "IsTruncated").text = "true" if is_truncated else "false"
-
-    for obj in objects:
-        contents = SubElement(root, "Contents")
-        SubElement(contents, "Key").text = obj.name
-        SubElement(contents, "LastModified").text = obj.last_modified.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        SubElement(contents, "ETag").text = f'"{obj.etag}"'
-        SubElement(contents, "Size").text = str(obj.size)
-        SubElement(contents, "StorageClass").text = "STANDARD"
-
-    if is_truncated and next_marker:
-        SubElement(root, "NextContinuationToken").text = next_marker
-
+    listing: AsyncIterable,
+    continuation_token_for: Callable[[str], str],
+    delimiter: str = None,
+    start_after: str = None,
+    owner_id: str = None,
+) -> AsyncIterator[bytes]:
+    """
+    Generates an S3-compatible ListBucketResult (V2) XML response as an async
+    stream of byte chunks. Entries are pulled from the listing (see crud.ObjectListing) and
+    written as pre-escaped fragments while rows arrive, so the first bytes go out
+    immediately and memory stays constant. Fields only known once the listing is
+    exhausted (KeyCount, IsTruncated, NextContinuationToken) are written last.
+    """
+    head = [XML_DECLARATION, f'<ListBucketResult xmlns="{S3_XMLNS}">', _element("Name", bucket_name), _element("Prefix", prefix)]
+    if delimiter:
+        head.append(_element("Delimiter", delimiter))
+    if start_after:
+        head.append(_element("StartAfter", start_after))
     if marker:
-        SubElement(root, "ContinuationToken").text = marker
+        head.append(_element("ContinuationToken", marker))
+    head.append(_element("MaxKeys", str(max_keys)))
+    yield "".join(head).encode()
+
+    owner = f"<Owner>{_element('ID', owner_id)}{_element('DisplayName', owner_id)}</Owner>" if owner_id else ""
+    buffer = []
+    buffered = 0
+    common_prefixes = []
+    key_count = 0
+    async for entry in listing:
+        key_count += 1
+        if isinstance(entry, str):
+            # Common prefixes are emitted together after the objects
+            common_prefixes.append(entry)
+            continue
+        fragment = (
+            f"<Contents>{_element('Key', entry.name)}"
+            f"<LastModified>{entry.last_modified.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}</LastModified>"
+            f"<ETag>&quot;{escape(entry.etag)}&quot;</ETag>"
+            f"<Size>{entry.size}</Size><StorageClass>STANDARD</StorageClass>{owner}</Contents>"
+        )
+        buffer.append(fragment)
+        buffered += len(fragment)
+        if buffered >= STREAM_FLUSH_SIZE:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            buffered = 0
 
-    return tostring(root, encoding="utf-8")
\ No newline at end of file
+    for common_prefix in common_prefixes:
+        buffer.append(f"<CommonPrefixes>{_element('Prefix', common_prefix)}</CommonPrefixes>")
+    buffer.append(_element("KeyCount", str(key_count)))
+    buffer.append(_element("IsTruncated", "true" if listing.is_truncated else "false"))
+    if listing.is_truncated and listing.next_marker:
+        buffer.append(_element("NextContinuationToken", continuation_token_for(listing.next_marker)))
+    buffer.append("</ListBucketResult>")
+    yield "".join(buffer).encode()
@@ -1,37 +1,162 @@
+import asyncio
+from collections import Counter
+from dataclasses import replace
+import hashlib
+import mimetypes
+import posixpath
 import uuid
+from datetime import datetime
+from urllib.parse import unquote
+from typing import AsyncIterator, Callable
 import xml.etree.ElementTree as ET
 from fastapi import APIRouter, Depends, Request, Response, HTTPException, Query
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from auth import get_current_user
-from database import get_db
+import cache
+import compression
+from cache import UserInfo
+from database import AsyncSessionLocal, get_db
 import crud
-import models
+import integrity
+import serving
 import storage
+import tarstream
+from batching import batcher
+from config import BULK_INGEST_BATCH_SIZE, INLINE_OBJECT_MAX_SIZE, IO_THREAD_POOL_SIZE, OBJECT_CACHE_MAX_OBJECT_SIZE, UPLOAD_CHUNK_SIZE
+from workers import run_blocking
 from responses import (
     generate_error_response,
     initiate_multipart_upload_response,
     complete_multipart_upload_response,
     generate_location_response,
     generate_list_objects_v2_response,
+    delete_result_response,
+    copy_result_response,
+    compression_configuration_response,
 )
 import os
 
 router = APIRouter()
 
+# Maximum number of keys accepted by a single DeleteObjects request, as in S3
+MAX_DELETE_KEYS = 1000
+
+
+def _upload_stream(request: Request, checks: integrity.PayloadChecks) -> AsyncIterator[bytes]:
+    """Returns the upload body, with any aws-chunked framing removed and verified."""
+    payload_mode = request.headers.get("x-amz-content-sha256", "")
+    if payload_mode not in integrity.STREAMING_PAYLOADS:
+        return request.stream()
+    signer = getattr(request.state, "chunk_signer", None)
+    if signer is None and payload_mode != integrity.STREAMING_UNSIGNED_TRAILER:
+        raise integrity.IntegrityError("AccessDenied", "Chunk signatures could not be verified.", status_code=403)
+    return integrity.decode_aws_chunked(request.stream(), checks, signer)
+
+
+def _declared_size(request: Request, checks: integrity.PayloadChecks) -> int | None:
+    """Returns the size of the object being uploaded as announced by its headers, if any."""
+    if request.headers.get("x-amz-content-sha256", "") in integrity.STREAMING_PAYLOADS:
+        return checks.decoded_length
+    content_length = request.headers.get("content-length", "")
+    return int(content_length) if content_length.isdigit() else None
+
+
+def _upload_headers(etag: str, checks: integrity.PayloadChecks) -> dict:
+    headers = {"ETag": f'"{etag}"'}
+    if checks.computed_checksum:
+        headers[f"x-amz-checksum-{checks.checksum_algorithm}"] = checks.computed_checksum
+    return headers
+
+
+def _serve_object(request: Request, db_object: cache.ObjectInfo, resource: str, send_body: bool = True) -> Response:
+    """
+    Builds the response for GetObject/HeadObject: evaluates conditional headers,
+    then resolves either the partNumber query parameter or the Range header into
+    byte ranges of the stored file.
+    """
+    headers = {
+        "ETag": f'"{db_object.etag}"',
+        "Last-Modified": serving.http_date(db_object.last_modified),
+        "Accept-Ranges": "bytes",
+    }
+    part_sizes = [int(size) for size in db_object.part_sizes.split(",")] if db_object.part_sizes else None
+    if part_sizes:
+        headers["x-amz-mp-parts-count"] = str(len(part_sizes))
+
+    precondition = serving.evaluate_preconditions(request.headers, db_object.etag, db_object.last_modified)
+    if precondition == 412:
+        error_xml = generate_error_response("PreconditionFailed", "At least one of the pre-conditions you specified did not hold.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=412)
+    if precondition == 304:
+        return Response(status_code=304, headers=headers)
+
+    ranges = None
+    part_number = request.query_params.get("partNumber")
+    range_header = request.headers.get("range")
+    if part_number is not None:
+        if range_header:
+            error_xml = generate_error_response("InvalidRequest", "Cannot specify both Range header and partNumber query parameter.", resource)
+            return Response(content=error_xml, media_type="application/xml", status_code=400)
+        sizes = part_sizes or [db_object.size]
+        try:
+            part_number = int(part_number)
+        except ValueError:
+            part_number = 0
+        if not 1 <= part_number <= len(sizes):
+            error_xml = generate_error_response("InvalidPartNumber", "The requested partnumber is not satisfiable.", resource)
+            return Response(content=error_xml, media_type="application/xml", status_code=416)
+        start = sum(sizes[:part_number - 1])
+        if sizes[part_number - 1]:
+            ranges = [(start, start + sizes[part_number - 1] - 1)]
+    elif range_header and serving.range_applies(request.headers, db_object.etag, db_object.last_modified):
+        try:
+            ranges = serving.parse_range_header(range_header, db_object.size)
+        except serving.RangeNotSatisfiable:
+            error_xml = generate_error_response("InvalidRange", "The requested range is not satisfiable.", resource)
+            return Response(
+                content=error_xml,
+                media_type="application/xml",
+                status_code=416,
+                headers={"Content-Range": f"bytes */{db_object.size}"},
+            )
+
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{db_object.size}"
+
+    return serving.FileRangeResponse(
+        path=db_object.filepath,
+        file_size=db_object.size,
+        ranges=ranges,
+        headers=headers,
+        media_type=db_object.content_type,
+        status_code=206 if ranges else 200,
+        send_body=send_body,
+        data=db_object.data if send_body else None,
+        compression=db_object.compression,
+        resource=resource,
+    )
+
+
+def _integrity_error_response(error: integrity.IntegrityError, resource: str) -> Response:
+    error_xml = generate_error_response(error.code, str(error), resource)
+    return Response(content=error_xml, media_type="application/xml", status_code=error.status_code)
+
+
 @router.get("/{bucket_name}/")
 @router.get("/{bucket_name}")
-def get_bucket(
+async def get_bucket(
     bucket_name: str,
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
 ):
     """
     Handles GET requests on a bucket.
     Differentiates between GetBucketLocation and ListObjects based on query params.
     """
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         error_xml = generate_error_response("NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}")
         return Response(content=error_xml, media_type="application/xml", status_code=404)
@@ -41,30 +166,67 @@ def get_bucket(
         xml_response = generate_location_response()
         return Response(content=xml_response, media_type="application/xml")
 
+    # Download everything under a prefix as one tar archive. Checked before
+    # GetBucketCompression, as it takes a compression parameter too.
+    if "archive" in request.query_params:
+        return _get_archive(request, bucket)
+
+    # Handle GetBucketCompression
+    if "compression" in request.query_params:
+        return Response(content=compression_configuration_response(bucket.compression), media_type="application/xml")
+
     # Handle ListObjectsV2
     if "list-type" in request.query_params and request.query_params["list-type"] == "2":
         prefix = request.query_params.get("prefix", "")
-        max_keys = int(request.query_params.get("max-keys", 1000))
+        delimiter = request.query_params.get("delimiter") or None
+        start_after = request.query_params.get("start-after") or None
+        fetch_owner = request.query_params.get("fetch-owner", "").lower() == "true"
         continuation_token = request.query_params.get("continuation-token")
 
-        objects, is_truncated, next_token = crud.list_objects(
-            db,
-            bucket_id=bucket.id,
-            prefix=prefix,
-            marker=continuation_token,
-            limit=max_keys,
-        )
+        try:
+            max_keys = int(request.query_params.get("max-keys", crud.MAX_LIST_KEYS))
+            if max_keys < 0:
+                raise ValueError
+        except ValueError:
+            error_xml = generate_error_response("InvalidArgument", "max-keys must be a non-negative integer.", f"/{bucket_name}")
+            return Response(content=error_xml, media_type="application/xml", status_code=400)
+        # Never return more than one page's worth of keys, whatever the client asks for
+        max_keys = min(max_keys, crud.MAX_LIST_KEYS)
 
-        xml_response = generate_list_objects_v2_response(
-            bucket_name=bucket.name,
-            prefix=prefix,
-            marker=continuation_token,
-            max_keys=max_keys,
-            is_truncated=is_truncated,
-            objects=objects,
-            next_marker=next_token,
-        )
-        return Response(content=xml_response, media_type="application/xml")
+        marker = None
+        if continuation_token:
+            try:
+                marker = crud.decode_continuation_token(continuation_token, prefix, delimiter)
+            except crud.InvalidContinuationToken as e:
+                error_xml = generate_error_response("InvalidArgument", str(e), f"/{bucket_name}")
+                return Response(content=error_xml, media_type="application/xml", status_code=400)
+
+        async def stream_listing():
+            # The listing outlives this handler, so it reads through its own session
+            async with AsyncSessionLocal() as listing_db:
+                listing = crud.ObjectListing(
+                    listing_db,
+                    bucket_id=bucket.id,
+                    prefix=prefix,
+                    marker=marker,
+                    limit=max_keys,
+                    delimiter=delimiter,
+                    start_after=start_after,
+                )
+                async for chunk in generate_list_objects_v2_response(
+                    bucket_name=bucket.name,
+                    prefix=prefix,
+                    marker=continuation_token,
+                    max_keys=max_keys,
+                    listing=listing,
+                    continuation_token_for=lambda next_marker: crud.encode_continuation_token(next_marker, prefix, delimiter),
+                    delimiter=delimiter,
+                    start_after=start_after,
+                    owner_id=current_user.access_key if fetch_owner else None,
+                ):
+                    yield chunk
+
+        return StreamingResponse(stream_listing(), media_type="application/xml")
 
     # Fallback for other unimplemented GET bucket operations
     return Response(
@@ -74,115 +236,315 @@ def get_bucket(
     )
 
 
+def _get_archive(request: Request, bucket: cache.BucketInfo) -> Response:
+    """
+    Streams every object under ?prefix as a tar archive, compressed with gzip or
+    zstd if ?compression asks for it. Members are named relative to the last
+    "/" of the prefix, so extracting the archive with snowball-auto-extract
+    under the same prefix recreates the objects.
+    """
+    prefix = request.query_params.get("prefix", "")
+    algorithm = request.query_params.get("compression") or None
+    if algorithm not in tarstream.ARCHIVE_COMPRESSIONS:
+        error_xml = generate_error_response("InvalidArgument", "compression must be gzip or zstd.", f"/{bucket.name}")
+        return Response(content=error_xml, media_type="application/xml", status_code=400)
+    if algorithm == "zstd" and not compression.available("zstd"):
+        error_xml = generate_error_response("NotImplemented", "zstd needs the zstandard package on the server.", f"/{bucket.name}")
+        return Response(content=error_xml, media_type="application/xml", status_code=501)
+    strip = prefix.rfind("/") + 1
+
+    async def members():
+        after = None
+        while True:
+            # A short-lived session per page, so no connection is held while data is sent
+            async with AsyncSessionLocal() as page_db:
+                page = await crud.get_object_page(page_db, bucket.id, prefix, after, crud.ARCHIVE_PAGE_SIZE)
+            for object_info in page:
+                if object_info.name[strip:]:
+                    yield object_info.name[strip:], object_info
+            if len(page) < crud.ARCHIVE_PAGE_SIZE:
+                return
+            after = page[-1].name
+
+    filename = bucket.name + {None: ".tar", "gzip": ".tar.gz", "zstd": ".tar.zst"}[algorithm]
+    return serving.ArchiveResponse(
+        members(),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        media_type=tarstream.ARCHIVE_COMPRESSIONS[algorithm],
+        compressor=tarstream.archive_compressor(algorithm),
+    )
+
+
 @router.head("/{bucket_name}/")
 @router.head("/{bucket_name}")
-def head_bucket(bucket_name: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+async def head_bucket(bucket_name: str, db: AsyncSession = Depends(get_db), current_user: UserInfo = Depends(get_current_user)):
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         return Response(status_code=404)
     return Response(status_code=200)
 
 @router.put("/{bucket_name}/")
 @router.put("/{bucket_name}")
-def create_bucket(bucket_name: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    if crud.get_bucket_by_name(db, name=bucket_name):
+async def create_bucket(bucket_name: str, request: Request, db: AsyncSession = Depends(get_db), current_user: UserInfo = Depends(get_current_user)):
+    if "compression" in request.query_params:
+        return await _put_bucket_compression(bucket_name, request, db, current_user)
+
+    if await crud.get_bucket_by_name(db, name=bucket_name):
         error_xml = generate_error_response("BucketAlreadyOwnedByYou", "Your previous request to create the named bucket succeeded and you already own it.", f"/{bucket_name}")
         return Response(content=error_xml, media_type="application/xml", status_code=409)
     
-    crud.create_bucket(db, name=bucket_name, owner_id=current_user.id)
-    storage.create_bucket_folder(bucket_name)
+    await crud.create_bucket(db, name=bucket_name, owner_id=current_user.id)
+    await run_blocking(storage.create_bucket_folder, bucket_name)
+    return Response(status_code=200)
+
+async def _put_bucket_compression(bucket_name: str, request: Request, db: AsyncSession, current_user: UserInfo) -> Response:
+    """
+    Sets the compression of a bucket from a body such as
+    <CompressionConfiguration><Algorithm>zstd</Algorithm></CompressionConfiguration>.
+    It applies to objects written from now on; existing objects keep theirs.
+    """
+    resource = f"/{bucket_name}"
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
+    if not bucket or bucket.owner_id != current_user.id:
+        error_xml = generate_error_response("NoSuchBucket", "The specified bucket does not exist.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=404)
+
+    body = await request.body()
+    try:
+        integrity.verify_body(integrity.payload_checks(request.headers), body)
+    except integrity.IntegrityError as e:
+        return _integrity_error_response(e, resource)
+    try:
+        algorithm = next(
+            (child.text or "").strip() for child in ET.fromstring(body) if _local_name(child.tag) == "Algorithm"
+        )
+    except (ET.ParseError, StopIteration):
+        error_xml = generate_error_response("MalformedXML", "The XML you provided was not well-formed or did not validate against our published schema.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=400)
+
+    algorithm = None if algorithm.upper() == "NONE" else algorithm.lower()
+    if algorithm is not None and algorithm not in compression.ALGORITHMS:
+        error_xml = generate_error_response("InvalidArgument", f"Unsupported compression algorithm '{algorithm}'.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=400)
+    if algorithm is not None and not compression.available(algorithm):
+        error_xml = generate_error_response("NotImplemented", f"The {algorithm} algorithm needs the zstandard package on the server.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=501)
+    await crud.set_bucket_compression(db, bucket.id, algorithm)
     return Response(status_code=200)
 
 @router.get("/{bucket_name}/{object_name:path}/")
 @router.get("/{bucket_name}/{object_name:path}")
-def get_object(
+async def get_object(
     bucket_name: str,
     object_name: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
 ):
     """
     Handles GET requests to retrieve an object.
-    This is used by clients like Minio's fget_object.
+    This is used by clients like Minio's fget_object, and supports Range,
+    partNumber and conditional requests so clients can download in parallel.
     """
     # 1. Verify the bucket exists and the user owns it
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         error_xml = generate_error_response(
             "NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}"
         )
         return Response(content=error_xml, media_type="application/xml", status_code=404)
 
-    # 2. Retrieve the object's metadata from the database
-    db_object = crud.get_object_by_bucket_and_name(db, bucket_id=bucket.id, name=object_name)
+    # 2. Retrieve the object's metadata (and the data of an inline object), from
+    # the object cache if it is hot there
+    since = cache.objects.generation()
+    db_object = await crud.get_object_info(db, bucket_id=bucket.id, name=object_name)
     if not db_object:
         error_xml = generate_error_response(
             "NoSuchKey", "The specified key does not exist.", f"/{bucket_name}/{object_name}"
         )
         return Response(content=error_xml, media_type="application/xml", status_code=404)
 
-    # 3. Set S3-compatible headers for the response
-    headers = {
-        "ETag": f'"{db_object.etag}"',
-        "Last-Modified": db_object.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
-        "Content-Length": str(db_object.size),
-        "Content-Type": db_object.content_type,
-    }
-
-    # 4. Stream the file from storage using FileResponse
-    return FileResponse(
-        path=db_object.filepath,
-        headers=headers,
-        media_type=db_object.content_type
-    )
+    # 3. Serve the object, honouring conditional headers, Range and partNumber.
+    # The pooled connection is returned first, rather than held while the body streams.
+    await db.close()
+    if db_object.data is None and db_object.size <= OBJECT_CACHE_MAX_OBJECT_SIZE and cache.objects.max_bytes:
+        # Small object stored in a file: cache its body so the next GETs skip the filesystem
+        try:
+            data = await run_blocking(storage.read_object, db_object.filepath, db_object.compression)
+        except (FileNotFoundError, ValueError):
+            data = None  # Deleted or replaced meanwhile; serving the file reports it
+        if data is not None and len(data) == db_object.size:
+            db_object = replace(db_object, data=data)
+            cache.objects.set((bucket.id, object_name), db_object, since)
+    return _serve_object(request, db_object, f"/{bucket_name}/{object_name}")
 
 @router.head("/{bucket_name}/{object_name:path}")
-def head_object(
+async def head_object(
     bucket_name: str,
     object_name: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
 ):
     """Handles HEAD requests for an object to retrieve metadata."""
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         return Response(status_code=404, content=generate_error_response("NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}"))
 
-    db_object = crud.get_object_by_bucket_and_name(db, bucket_id=bucket.id, name=object_name)
+    db_object = await crud.get_object_info(db, bucket_id=bucket.id, name=object_name)
     if not db_object:
         return Response(status_code=404, content=generate_error_response("NoSuchKey", "The specified key does not exist.", f"/{bucket_name}/{object_name}"))
 
-    headers = {
-        "ETag": f'"{db_object.etag}"',
-        "Content-Length": str(db_object.size),
-        "Content-Type": db_object.content_type,
-        "Last-Modified": db_object.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
-    }
-    return Response(status_code=200, headers=headers)
+    return _serve_object(request, db_object, f"/{bucket_name}/{object_name}", send_body=False)
+
+def _local_name(tag: str) -> str:
+    """Strips the XML namespace, since clients differ on whether they send one."""
+    return tag.rsplit("}", 1)[-1]
+
+async def _record_part(resource: str, **fields) -> Response | None:
+    """
+    Records an uploaded part, then deletes the file of the upload it replaced,
+    if any. If the multipart upload was completed or aborted meanwhile, removes
+    the part files written for it since and returns a NoSuchUpload error response.
+    """
+    recorded, replaced = await batcher.submit(crud.upsert_multipart_part, **fields)
+    if replaced:
+        await run_blocking(storage.delete_object, replaced)
+    if not recorded:
+        await run_blocking(storage.cleanup_parts, fields["upload_id"])
+        error_xml = generate_error_response("NoSuchUpload", "The specified multipart upload does not exist.", resource)
+        return Response(content=error_xml, media_type="application/xml", status_code=404)
+    return None
+
+async def _record_object(**fields) -> datetime:
+    """
+    Records an object's metadata, then deletes the data file of the version it
+    replaced, if that was stored at a different path. Returns the last-modified time.
+    """
+    last_modified, replaced = await batcher.submit(crud.upsert_object, **fields)
+    cache.objects.invalidate((fields["bucket_id"], fields["name"]))
+    if replaced:
+        try:
+            await run_blocking(storage.delete_object, replaced)
+        except OSError:
+            pass  # Already logged; the new version is in place regardless
+    return last_modified
+
+def _acquire_blobs(acquired: list[str]) -> Callable[[str, int], None]:
+    """
+    Returns a before_place hook that takes a reference on each blob through the
+    batcher and notes its path in acquired, so the reference can be given back
+    if the object ends up not being recorded (see _release_blobs).
+    """
+    def acquire(filepath: str, size: int):
+        batcher.call(crud.acquire_blob, filepath, size)
+        acquired.append(filepath)
+    return acquire
+
+async def _release_blobs(acquired: list[str]):
+    """Gives back blob references taken for an object whose placement or recording failed."""
+    if acquired:
+        await batcher.submit(crud.release_blobs, acquired)
+
+# Registered before the object-level POST route, which would also match "/{bucket_name}/"
+@router.post("/{bucket_name}/")
+@router.post("/{bucket_name}")
+async def bucket_actions(
+    bucket_name: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Handles POST requests on a bucket. Currently this is DeleteObjects (?delete),
+    which removes up to 1000 keys with one lookup query, one transaction and
+    concurrent file unlinks on the I/O thread pool.
+    """
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
+    if not bucket or bucket.owner_id != current_user.id:
+        error_xml = generate_error_response("NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}")
+        return Response(content=error_xml, media_type="application/xml", status_code=404)
+
+    if "delete" not in request.query_params:
+        return Response(
+            content=generate_error_response("NotImplemented", "The requested bucket operation is not implemented.", f"/{bucket_name}"),
+            media_type="application/xml",
+            status_code=501
+        )
+
+    # 1. Verify and parse the list of keys to delete
+    body = await request.body()
+    try:
+        integrity.verify_body(integrity.payload_checks(request.headers), body)
+    except integrity.IntegrityError as e:
+        return _integrity_error_response(e, f"/{bucket_name}")
+    keys = []
+    quiet = False
+    try:
+        xml_body = ET.fromstring(body)
+        for child in xml_body:
+            if _local_name(child.tag) == "Quiet":
+                quiet = (child.text or "").strip().lower() == "true"
+            elif _local_name(child.tag) == "Object":
+                key = next(c.text for c in child if _local_name(c.tag) == "Key")
+                if key is None:
+                    raise ValueError("Empty key")
+                keys.append(key)
+    except (ET.ParseError, StopIteration, ValueError):
+        keys = []
+    if not keys or len(keys) > MAX_DELETE_KEYS:
+        error_xml = generate_error_response("MalformedXML", "The XML you provided was not well-formed or did not validate against our published schema.", f"/{bucket_name}")
+        return Response(content=error_xml, media_type="application/xml", status_code=400)
+    keys = list(dict.fromkeys(keys))
+
+    # 2. Resolve every key in one query, then unlink the files concurrently
+    db_objects = await crud.get_objects_by_names(db, bucket.id, keys)
+    file_objects = [obj for obj in db_objects if not storage.is_inline(obj.filepath)]
+    results = await asyncio.gather(
+        *(run_blocking(storage.delete_object, obj.filepath) for obj in file_objects),
+        return_exceptions=True,
+    )
+    failed = {obj.name for obj, result in zip(file_objects, results) if isinstance(result, Exception)}
+
+    # 3. Drop the records whose files are gone in a single transaction
+    await batcher.submit(crud.delete_objects, [obj.id for obj in db_objects if obj.name not in failed])
+    for obj in db_objects:
+        if obj.name not in failed:
+            cache.objects.invalidate((bucket.id, obj.name))
+
+    # Like DeleteObject, keys that did not exist are reported as deleted
+    deleted = [key for key in keys if key not in failed]
+    errors = [(key, "InternalError", "We encountered an internal error. Please try again.") for key in keys if key in failed]
+    return Response(content=delete_result_response(deleted, errors, quiet), media_type="application/xml")
+
 
 @router.post("/{bucket_name}/{object_name:path}")
 async def multipart_actions(
     bucket_name: str, 
     object_name: str, 
     request: Request, 
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    current_user: UserInfo = Depends(get_current_user)
     ):
     if "uploads" in request.query_params:
         # Initiate Multipart Upload
         upload_id = str(uuid.uuid4())
-        crud.create_multipart_upload(db, upload_id=upload_id, bucket_name=bucket_name, object_name=object_name)
+        await batcher.submit(crud.create_multipart_upload, upload_id=upload_id, bucket_name=bucket_name, object_name=object_name)
         xml_response = initiate_multipart_upload_response(bucket_name, object_name, upload_id)
         return Response(content=xml_response, media_type="application/xml")
     
     if "uploadId" in request.query_params:
         # Complete Multipart Upload
         upload_id = request.query_params["uploadId"]
-        upload = crud.get_multipart_upload(db, upload_id)
+        upload = await crud.get_multipart_upload(db, upload_id)
         if not upload:
             raise HTTPException(status_code=404, detail="Upload not found")
         
         body = await request.body()
+        try:
+            integrity.verify_body(integrity.payload_checks(request.headers), body)
+        except integrity.IntegrityError as e:
+            return _integrity_error_response(e, f"/{bucket_name}/{object_name}")
         xml_body = ET.fromstring(body)
 
         namespace = {'s3': xml_body.tag.split('}')[0].strip('{')}
@@ -193,65 +555,422 @@ async def multipart_actions(
             for p in xml_body.findall("s3:Part", namespace)
         }
         
-        db_parts = sorted(upload.parts, key=lambda p: p.part_number)
-        if len(client_parts) != len(db_parts) or any(client_parts[p.part_number] != p.etag for p in db_parts):
+        db_parts = await crud.get_multipart_parts(db, upload_id)
+        if not db_parts or len(client_parts) != len(db_parts) or any(client_parts.get(p.part_number) != p.etag for p in db_parts):
              raise HTTPException(status_code=400, detail="Invalid parts list")
 
-        size, etag = storage.combine_parts(bucket_name, object_name, db_parts)
-        bucket = crud.get_bucket_by_name(db, bucket_name)
-        
-        crud.create_object(db, bucket_id=bucket.id, name=object_name, size=size, etag=etag, filepath=str(storage.STORAGE_ROOT / bucket_name / object_name), content_type="application/octet-stream")
-        crud.delete_multipart_upload(db, upload_id)
+        # Check every part file on the I/O pool at once rather than one after another
+        part_sizes = await asyncio.gather(*(run_blocking(storage.verify_part, p.filepath, p.size) for p in db_parts))
+        combined = None
+        if None not in part_sizes:
+            try:
+                combined = await run_blocking(storage.combine_parts, bucket_name, object_name, db_parts, part_sizes)
+            except FileNotFoundError:
+                pass  # A part was uploaded again while this request was running
+        if combined is None:
+            error_xml = generate_error_response("InvalidPart", "One or more of the specified parts could not be found.", f"/{bucket_name}/{object_name}")
+            return Response(content=error_xml, media_type="application/xml", status_code=400)
+        size, etag, part_sizes, filepath = combined
+        bucket = await crud.get_bucket_info(db, bucket_name)
+        acquired = []
+        try:
+            if storage.is_blob_path(filepath):
+                await batcher.submit(crud.acquire_blob, filepath, size)
+                acquired.append(filepath)
+            await _record_object(bucket_id=bucket.id, name=object_name, size=size, etag=etag, filepath=filepath, content_type="application/octet-stream", part_sizes=part_sizes)
+        except Exception:
+            await _release_blobs(acquired)
+            raise
+        await batcher.submit(crud.delete_multipart_upload, upload_id)
+        # Parts recorded while this request ran lost their rows along with the upload
+        await run_blocking(storage.cleanup_parts, upload_id)
         
         location = f"http://{request.headers['host']}/{bucket_name}/{object_name}"
-        xml_response = complete_multipart_upload_response(bucket_name, object_name, etag, location)
+        xml_response = complete_multipart_upload_response(bucket_name, object_name, f'"{etag}"', location)
         return Response(content=xml_response, media_type="application/xml")
 
     raise HTTPException(status_code=400, detail="Invalid request")
 
 
 @router.put("/{bucket_name}/{object_name:path}")
-async def put_object(bucket_name: str, object_name: str, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+async def put_object(bucket_name: str, object_name: str, request: Request, db: AsyncSession = Depends(get_db), current_user: UserInfo = Depends(get_current_user)):
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Bucket not found")
 
     content_type = request.headers.get("content-type", "application/octet-stream")
-    body = await request.body()
+    resource = f"/{bucket_name}/{object_name}"
+    try:
+        checks = integrity.payload_checks(request.headers)
+    except integrity.IntegrityError as e:
+        return _integrity_error_response(e, resource)
 
     if "uploadId" in request.query_params and "partNumber" in request.query_params:
         # Upload Part
         upload_id = request.query_params["uploadId"]
         part_number = int(request.query_params["partNumber"])
         
-        upload = crud.get_multipart_upload(db, upload_id)
+        upload = await crud.get_multipart_upload(db, upload_id)
         if not upload or upload.bucket_name != bucket_name or upload.object_name != object_name:
             raise HTTPException(status_code=404, detail="Upload ID not found for this object.")
 
-        filepath, etag = storage.save_part(upload_id, part_number, body)
-        crud.create_multipart_part(db, upload_id=upload_id, part_number=part_number, etag=etag, filepath=filepath)
+        if "x-amz-copy-source" in request.headers:
+            return await _upload_part_copy(request, db, current_user, upload_id, part_number, f"/{bucket_name}/{object_name}")
+
+        await db.close()  # Don't hold a pooled connection while the body streams
+        try:
+            filepath, etag, size = await storage.save_part(upload_id, part_number, _upload_stream(request, checks), checks)
+        except integrity.IntegrityError as e:
+            return _integrity_error_response(e, resource)
+        error = await _record_part(resource, upload_id=upload_id, part_number=part_number, etag=etag, filepath=filepath, size=size)
+        if error:
+            return error
         
-        return Response(headers={"ETag": f'"{etag}"'})
+        return Response(headers=_upload_headers(etag, checks))
+
+    if "x-amz-copy-source" in request.headers:
+        return await _copy_object(request, db, current_user, bucket, object_name, content_type)
+
+    if request.headers.get("x-amz-meta-snowball-auto-extract", "").lower() == "true":
+        await db.close()  # Don't hold a pooled connection while the archive streams
+        try:
+            return await _extract_archive(request, bucket, object_name, checks)
+        except integrity.IntegrityError as e:
+            return _integrity_error_response(e, resource)
 
     # Single part upload
-    size, etag = storage.save_object(bucket_name, object_name, body)
-    crud.create_object(db, bucket_id=bucket.id, name=object_name, size=size, etag=etag, filepath=str(storage.STORAGE_ROOT / bucket_name / object_name), content_type=content_type)
+    await db.close()  # Don't hold a pooled connection while the body streams
+    declared_size = _declared_size(request, checks)
+    if declared_size is not None and declared_size <= INLINE_OBJECT_MAX_SIZE:
+        # Small enough to be stored in its metadata row, without creating a file
+        try:
+            data = await _read_small_body(_upload_stream(request, checks), declared_size)
+            etag = integrity.verify_body(checks, data)
+        except integrity.IntegrityError as e:
+            return _integrity_error_response(e, resource)
+        await _record_object(bucket_id=bucket.id, name=object_name, size=len(data), etag=etag, filepath="", content_type=content_type, data=data)
+        return Response(headers=_upload_headers(etag, checks))
+
+    acquired = []
+    try:
+        size, etag, filepath, stored_with, stored_size = await storage.save_object(
+            bucket_name, object_name, _upload_stream(request, checks), checks,
+            before_place=_acquire_blobs(acquired),
+            compression=bucket.compression,
+            content_type=content_type,
+        )
+        await _record_object(
+            bucket_id=bucket.id, name=object_name, size=size, etag=etag, filepath=filepath, content_type=content_type,
+            compression=stored_with, stored_size=stored_size if stored_with else None,
+        )
+    except integrity.IntegrityError as e:
+        return _integrity_error_response(e, resource)  # Rejected before any blob was referenced
+    except Exception:
+        await _release_blobs(acquired)
+        raise
     
-    return Response(headers={"ETag": f'"{etag}"'})
+    return Response(headers=_upload_headers(etag, checks))
+
+async def _read_small_body(stream: AsyncIterator[bytes], declared_size: int) -> bytes:
+    """Reads a body announced as declared_size bytes into memory, refusing to read more than that."""
+    data = bytearray()
+    async for chunk in stream:
+        data += chunk
+        if len(data) > declared_size:
+            raise integrity.IntegrityError("IncompleteBody", "The request body is longer than its declared size.")
+    return bytes(data)
+
+async def _verified_stream(stream: AsyncIterator[bytes], checks: integrity.PayloadChecks) -> AsyncIterator[bytes]:
+    """
+    Passes a request body through while computing the digests the client
+    declared for it on the I/O thread pool, and verifies them once it ends.
+    """
+    md5 = hashlib.md5() if checks.md5 else None
+    sha256 = hashlib.sha256() if checks.sha256 else None
+    checksum = checks.new_checksum()
+    hashers = [h for h in (md5, sha256, checksum) if h is not None]
+
+    def update(data: bytes):
+        for hasher in hashers:
+            hasher.update(data)
+
+    buffer = bytearray()
+    async for chunk in stream:
+        if not hashers:
+            yield chunk
+            continue
+        buffer += chunk
+        if len(buffer) >= UPLOAD_CHUNK_SIZE:
+            data = bytes(buffer)
+            buffer.clear()
+            await run_blocking(update, data)
+            yield data
+    if buffer:
+        data = bytes(buffer)
+        await run_blocking(update, data)
+        yield data
+    checks.verify(md5, sha256, checksum)
+
+def _archive_key(prefix: str, member_name: str) -> str | None:
+    """
+    Maps a tar member to its object key, or None for names that would climb out
+    of the prefix (e.g. "../x"), which are skipped. A leading "/" is dropped, as
+    tar does when extracting.
+    """
+    name = posixpath.normpath(member_name.lstrip("/"))
+    if name in (".", "..") or name.startswith("../"):
+        return None
+    return prefix + name
+
+async def _extract_archive(request: Request, bucket, object_name: str, checks: integrity.PayloadChecks) -> Response:
+    """
+    Bulk ingest, as with Snowball's auto-extract: the tar archive (optionally
+    gzip-compressed) in a PUT body is extracted into one object per regular
+    file, keyed by the PUT key's prefix up to its last "/" plus the member's
+    path. The archive itself is not stored.
+
+    Members are read as the body streams in. Small ones become inline objects;
+    others are written on the I/O thread pool while reading continues. Their
+    metadata is committed BULK_INGEST_BATCH_SIZE objects at a time rather than
+    once per object.
+
+    A body that still has to be verified (a signed aws-chunked body, or one
+    with a declared digest or checksum) is only known to be genuine once it has
+    been read to the end, so nothing is committed before then; only one batch
+    of small members is held in memory meanwhile, later ones are written to
+    files. Where those files would replace existing objects' data (PathLayout)
+    they are staged and only moved to their keys' paths once committed. A
+    failure (e.g. a truncated archive or a digest mismatch) stops the
+    extraction and discards every object not committed yet, so an unverified
+    body never becomes visible. Batches committed earlier, which only happens
+    for bodies with nothing to verify, are kept; sending the archive again
+    overwrites them.
+    """
+    prefix = object_name[:object_name.rfind("/") + 1]
+    acquired = []  # Blobs referenced for extracted objects
+    committed = Counter()  # Of those, the ones now referenced by committed objects
+    before_place = _acquire_blobs(acquired)
+    deferred = bool(checks.sha256 or checks.md5 or checks.checksum_algorithm or getattr(request.state, "chunk_signer", None))
+    staged = deferred and storage.layout.in_place
+    pending = []  # Metadata of extracted objects not committed yet
+    writes = {}  # Key -> task writing a member to its file
+    failures = []
+    slots = asyncio.Semaphore(IO_THREAD_POOL_SIZE)
+
+    async def flush(batch: list[dict]):
+        replaced = await batcher.submit(crud.upsert_objects, bucket.id, batch)
+        committed.update(fields["filepath"] for fields in batch if storage.is_blob_path(fields["filepath"]))
+        for fields in batch:
+            if "staged" in fields:
+                await run_blocking(storage.place_staged, fields["staged"], fields["filepath"])
+            cache.objects.invalidate((bucket.id, fields["name"]))
+        await asyncio.gather(*(run_blocking(storage.delete_object, filepath) for filepath in replaced), return_exceptions=True)
+
+    async def flush_batch():
+        # Commits the oldest pending objects; writes finishing meanwhile append to pending
+        batch = pending[:BULK_INGEST_BATCH_SIZE]
+        await flush(batch)
+        del pending[:len(batch)]
+
+    async def discard():
+        # Removes the files of objects that will not be committed, and the blob references taken for them
+        nonlocal pending
+        filepaths, pending = [fields.get("staged", fields["filepath"]) for fields in pending if fields["filepath"]], []
+        unused = Counter(acquired)
+        unused.subtract(committed)
+        await _release_blobs(list(unused.elements()))
+        if storage.layout.in_place and not staged:
+            return  # Files at their key's path replaced the data of any existing object, which still points there
+        await asyncio.gather(*(run_blocking(storage.delete_object, filepath) for filepath in filepaths), return_exceptions=True)
+
+    def record(key: str, content_type: str, size: int, etag: str, filepath: str, stored_with: str | None, stored_size: int):
+        fields = dict(
+            name=key, size=size, etag=etag, filepath=filepath, content_type=content_type,
+            compression=stored_with, stored_size=stored_size if stored_with else None,
+        )
+        if staged:
+            fields.update(staged=filepath, filepath=str(storage.object_path(bucket.name, key)))
+        pending.append(fields)
+
+    async def write(key: str, content_type: str, data: bytes):
+        try:
+            record(key, content_type, *await run_blocking(
+                storage.write_object, bucket.name, key, data, before_place, bucket.compression, content_type, staged,
+            ))
+        except Exception as e:
+            failures.append(e)
+        finally:
+            writes.pop(key, None)
+            slots.release()
+
+    reader = tarstream.TarReader(_verified_stream(_upload_stream(request, checks), checks))
+    try:
+        while (member := await reader.next_member()) is not None:
+            if failures:
+                raise failures[0]
+            key = _archive_key(prefix, member.name)
+            if key is None:
+                continue
+            content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+            if key in writes:
+                await writes[key]  # A key repeated in the archive: its last member must win
+            if member.size <= INLINE_OBJECT_MAX_SIZE and (not deferred or len(pending) < BULK_INGEST_BATCH_SIZE):
+                data = await reader.read_data()
+                pending.append(dict(name=key, size=len(data), etag=hashlib.md5(data).hexdigest(), filepath="", content_type=content_type, data=data))
+            elif member.size <= UPLOAD_CHUNK_SIZE:
+                data = await reader.read_data()
+                await slots.acquire()
+                writes[key] = asyncio.create_task(write(key, content_type, data))
+            else:
+                record(key, content_type, *await storage.save_object(
+                    bucket.name, key, reader.iter_data(), before_place=before_place,
+                    compression=bucket.compression, content_type=content_type, staged=staged,
+                ))
+            if len(pending) >= BULK_INGEST_BATCH_SIZE and not deferred:
+                await flush_batch()
+        await reader.drain()
+        await asyncio.gather(*writes.values())
+        if failures:
+            raise failures[0]
+        # The whole body has been read and verified
+        while pending:
+            await flush_batch()
+    except BaseException:
+        await asyncio.gather(*writes.values())
+        await discard()
+        raise
+
+    headers = {}
+    if checks.computed_checksum:
+        headers[f"x-amz-checksum-{checks.checksum_algorithm}"] = checks.computed_checksum
+    return Response(headers=headers)
+
+async def _resolve_copy_source(request: Request, db: AsyncSession, current_user: UserInfo, resource: str):
+    """
+    Looks up the object named by x-amz-copy-source and checks the
+    x-amz-copy-source-if-* preconditions. Returns (object, None) on success or
+    (None, error_response).
+    """
+    source = unquote(request.headers["x-amz-copy-source"].split("?", 1)[0]).lstrip("/")
+    src_bucket_name, _, src_key = source.partition("/")
+    src_bucket = await crud.get_bucket_info(db, name=src_bucket_name)
+    if not src_bucket or not src_key or src_bucket.owner_id != current_user.id:
+        error_xml = generate_error_response("NoSuchBucket", "The specified bucket does not exist.", f"/{src_bucket_name}")
+        return None, Response(content=error_xml, media_type="application/xml", status_code=404)
+    src_object = await crud.get_object_by_bucket_and_name(db, bucket_id=src_bucket.id, name=src_key, with_data=True)
+    if not src_object:
+        error_xml = generate_error_response("NoSuchKey", "The specified key does not exist.", f"/{source}")
+        return None, Response(content=error_xml, media_type="application/xml", status_code=404)
+
+    copy_conditions = {
+        name.removeprefix("x-amz-copy-source-"): value
+        for name, value in request.headers.items()
+        if name.startswith("x-amz-copy-source-if-")
+    }
+    # For copies both a failed match and a "not modified" outcome are 412
+    if serving.evaluate_preconditions(copy_conditions, src_object.etag, src_object.last_modified):
+        error_xml = generate_error_response("PreconditionFailed", "At least one of the pre-conditions you specified did not hold.", resource)
+        return None, Response(content=error_xml, media_type="application/xml", status_code=412)
+    return src_object, None
+
+
+async def _copy_object(request: Request, db: AsyncSession, current_user: UserInfo, bucket, object_name: str, content_type: str) -> Response:
+    """CopyObject: duplicates a stored object under a new key without the data leaving the server."""
+    resource = f"/{bucket.name}/{object_name}"
+    src_object, error = await _resolve_copy_source(request, db, current_user, resource)
+    if error:
+        return error
+
+    replace_metadata = request.headers.get("x-amz-metadata-directive", "COPY").upper() == "REPLACE"
+    if src_object.bucket_id == bucket.id and src_object.name == object_name and not replace_metadata:
+        error_xml = generate_error_response(
+            "InvalidRequest",
+            "This copy request is illegal because it is trying to copy an object to itself without changing the object's metadata.",
+            resource,
+        )
+        return Response(content=error_xml, media_type="application/xml", status_code=400)
+
+    acquired = []
+    try:
+        if storage.is_inline(src_object.filepath):
+            stored_size, filepath = None, ""
+        else:
+            if storage.is_blob_path(src_object.filepath):
+                # The copy shares the source blob; reference it before the source can be released
+                await batcher.submit(crud.acquire_blob, src_object.filepath, src_object.stored_size or src_object.size)
+                acquired.append(src_object.filepath)
+            # A compressed source is copied as stored, so the copy stays compressed
+            stored_size, filepath = await run_blocking(
+                storage.copy_object, src_object.filepath, bucket.name, object_name,
+                src_object.compression, _acquire_blobs(acquired),
+            )
+        part_sizes = [int(n) for n in src_object.part_sizes.split(",")] if src_object.part_sizes else None
+        last_modified = await _record_object(
+            bucket_id=bucket.id,
+            name=object_name,
+            size=src_object.size,
+            etag=src_object.etag,
+            filepath=filepath,
+            content_type=content_type if replace_metadata else src_object.content_type,
+            part_sizes=part_sizes,
+            data=src_object.data if storage.is_inline(filepath) else None,
+            compression=src_object.compression,
+            stored_size=stored_size if src_object.compression else None,
+        )
+    except Exception:
+        await _release_blobs(acquired)
+        raise
+    xml_response = copy_result_response("CopyObjectResult", src_object.etag, last_modified)
+    return Response(content=xml_response, media_type="application/xml")
+
+
+async def _upload_part_copy(request: Request, db: AsyncSession, current_user: UserInfo, upload_id: str, part_number: int, resource: str) -> Response:
+    """UploadPartCopy: fills a multipart upload part from (a range of) a stored object."""
+    src_object, error = await _resolve_copy_source(request, db, current_user, resource)
+    if error:
+        return error
+
+    start, end = 0, src_object.size - 1
+    copy_range = request.headers.get("x-amz-copy-source-range")
+    if copy_range:
+        try:
+            ranges = serving.parse_range_header(copy_range, src_object.size)
+        except serving.RangeNotSatisfiable:
+            ranges = None
+        if not ranges or len(ranges) != 1:
+            error_xml = generate_error_response("InvalidArgument", "The x-amz-copy-source-range value must be of the form bytes=first-last where first and last are the zero-based offsets of the first and last bytes to copy.", resource)
+            return Response(content=error_xml, media_type="application/xml", status_code=400)
+        start, end = ranges[0]
+
+    if storage.is_inline(src_object.filepath):
+        filepath, etag, size = await run_blocking(storage.write_part, upload_id, part_number, src_object.data[start:end + 1])
+    else:
+        # A whole single-part object keeps its MD5, so its data can be cloned without hashing
+        whole_object = start == 0 and end == src_object.size - 1 and not src_object.part_sizes
+        filepath, etag, size = await run_blocking(
+            storage.copy_part, src_object.filepath, upload_id, part_number, start, end,
+            src_object.etag if whole_object else None, src_object.compression,
+        )
+    error = await _record_part(resource, upload_id=upload_id, part_number=part_number, etag=etag, filepath=filepath, size=size)
+    if error:
+        return error
+    xml_response = copy_result_response("CopyPartResult", etag, datetime.utcnow())
+    return Response(content=xml_response, media_type="application/xml")
+
 
 @router.delete("/{bucket_name}/")
 @router.delete("/{bucket_name}")
-def remove_bucket(
+async def remove_bucket(
     bucket_name: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
 ):
     """
     Handles bucket deletion requests.
     A bucket can only be deleted if it is empty.
     """
     # 1. Verify the bucket exists and the user owns it.
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         error_xml = generate_error_response(
             "NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}"
@@ -259,8 +978,7 @@ def remove_bucket(
         return Response(content=error_xml, media_type="application/xml", status_code=404)
 
     # 2. S3 Spec: Check if the bucket is empty before deletion.
-    # The back-populated 'objects' relationship on the Bucket model makes this easy.
-    if bucket.objects:
+    if await crud.bucket_has_objects(db, bucket.id):
         error_xml = generate_error_response(
             "BucketNotEmpty", "The bucket you tried to delete is not empty.", f"/{bucket_name}"
         )
@@ -268,7 +986,7 @@ def remove_bucket(
 
     # 3. Delete the physical bucket folder from storage.
     try:
-        storage.delete_bucket_folder(bucket.name)
+        await run_blocking(storage.delete_bucket_folder, bucket.name)
     except Exception as e:
         print(f"Error deleting bucket folder {bucket.name}: {e}")
         error_xml = generate_error_response(
@@ -277,19 +995,19 @@ def remove_bucket(
         return Response(content=error_xml, media_type="application/xml", status_code=500)
 
     # 4. Delete the bucket record from the database.
-    crud.delete_bucket(db, bucket_id=bucket.id)
+    await crud.delete_bucket(db, bucket_id=bucket.id)
 
     # 5. Return success (204 No Content).
     return Response(status_code=204)
 
     
 @router.delete("/{bucket_name}/{object_name:path}")
-def handle_object_delete(
+async def handle_object_delete(
     bucket_name: str,
     object_name: str,
     uploadId: str | None = Query(default=None), # Capture the optional 'uploadId' query param
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: UserInfo = Depends(get_current_user)
 ):
     """
     Handles DELETE requests for objects. Differentiates between:
@@ -297,7 +1015,7 @@ def handle_object_delete(
     2. Remove Object (if no 'uploadId' is present).
     """
     # Common logic: Verify the bucket exists and the user owns it.
-    bucket = crud.get_bucket_by_name(db, name=bucket_name)
+    bucket = await crud.get_bucket_info(db, name=bucket_name)
     if not bucket or bucket.owner_id != current_user.id:
         error_xml = generate_error_response(
             "NoSuchBucket", "The specified bucket does not exist.", f"/{bucket_name}"
@@ -307,7 +1025,7 @@ def handle_object_delete(
     # --- Action Dispatcher ---
     if uploadId:
         # === Abort Multipart Upload Logic ===
-        upload = crud.get_multipart_upload(db, uploadId)
+        upload = await crud.get_multipart_upload(db, uploadId)
         if not upload or upload.bucket_name != bucket_name or upload.object_name != object_name:
             error_xml = generate_error_response(
                 "NoSuchUpload",
@@ -316,22 +1034,24 @@ def handle_object_delete(
             )
             return Response(content=error_xml, media_type="application/xml", status_code=404)
 
-        # 1. Clean up stored part files from the disk
-        storage.cleanup_parts(uploadId)
-        
-        # 2. Delete the upload record from the database
-        crud.delete_multipart_upload(db, uploadId)
+        # 1. Delete the upload record from the database, so no more parts get recorded
+        await batcher.submit(crud.delete_multipart_upload, uploadId)
+
+        # 2. Clean up stored part files from the disk
+        await run_blocking(storage.cleanup_parts, uploadId)
 
         # 3. Return the correct success response
         return Response(status_code=204)
     else:
         # === Remove Object Logic ===
-        db_object = crud.get_object_by_bucket_and_name(db, bucket_id=bucket.id, name=object_name)
+        db_object = await crud.get_object_by_bucket_and_name(db, bucket_id=bucket.id, name=object_name)
 
         if db_object:
             try:
-                storage.delete_object(db_object.filepath)
-                crud.delete_object(db, object_id=db_object.id)
+                if not storage.is_inline(db_object.filepath):
+                    await run_blocking(storage.delete_object, db_object.filepath)
+                await batcher.submit(crud.delete_object, object_id=db_object.id)
+                cache.objects.invalidate((bucket.id, object_name))
             except Exception as e:
                 print(f"Error during object deletion {db_object.filepath}: {e}")
                 error_xml = generate_error_response(
@@ -0,0 +1,379 @@
+import logging
+import os
+import struct
+import uuid
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Mapping
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+import tarstream
+from cache import ObjectInfo
+from compression import FrameReader
+from config import DOWNLOAD_CHUNK_SIZE
+from responses import generate_error_response
+from workers import run_blocking
+
+# Upper bound on the number of ranges honoured in a single multi-range request
+MAX_RANGES = 100
+
+logger = logging.getLogger(__name__)
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlap the object."""
+
+
+def http_date(value: datetime) -> str:
+    return value.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+def _parse_http_date(value: str) -> datetime | None:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+    candidates = [c.strip() for c in header_value.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/").strip('"') == etag for c in candidates)
+
+
+def evaluate_preconditions(headers: Mapping[str, str], etag: str, last_modified: datetime) -> int | None:
+    """
+    Evaluates If-Match, If-Unmodified-Since, If-None-Match and If-Modified-Since
+    in the order S3 does. Returns 412 or 304 when the request should short-circuit,
+    or None when the object should be served.
+    """
+    # HTTP dates only carry whole seconds
+    last_modified = last_modified.replace(microsecond=0)
+
+    if_match = headers.get("if-match")
+    if if_match is not None:
+        if not _etag_matches(if_match, etag):
+            return 412
+    else:
+        since = _parse_http_date(headers.get("if-unmodified-since", ""))
+        if since is not None and last_modified > since:
+            return 412
+
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return 304
+    else:
+        since = _parse_http_date(headers.get("if-modified-since", ""))
+        if since is not None and last_modified <= since:
+            return 304
+    return None
+
+
+def range_applies(headers: Mapping[str, str], etag: str, last_modified: datetime) -> bool:
+    """Honours If-Range: a stale validator means the full object is sent instead."""
+    if_range = headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.strip().startswith(('"', "W/")):
+        return if_range.strip().strip('"') == etag
+    since = _parse_http_date(if_range)
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def parse_range_header(value: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parses a bytes Range header into inclusive (start, end) pairs clipped to the
+    object size. Returns None for headers that should be ignored (syntactically
+    invalid or non-bytes units) and raises RangeNotSatisfiable when no range
+    overlaps the object.
+    """
+    units, _, spec = value.partition("=")
+    if units.strip().lower() != "bytes" or not spec:
+        return None
+    specs = spec.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for item in specs:
+        first, sep, last = item.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length < 0:
+                    return None
+                if length == 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def _open_object(path: str, size: int, compression: str | None, sequential: bool = False) -> tuple[int, FrameReader | None] | None:
+    """
+    Opens an object file and checks it still holds size bytes of data, with a
+    FrameReader if it is compressed. Returns None if it was deleted or replaced
+    since its metadata was read. sequential hints the kernel to read ahead.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        reader = FrameReader(fd, compression) if compression else None
+        if (reader.logical_size if reader else os.fstat(fd).st_size) != size:
+            os.close(fd)
+            return None
+        if sequential and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return fd, reader
+    except (ValueError, struct.error):
+        os.close(fd)  # No longer a compressed object file
+        return None
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+class FileRangeResponse(Response):
+    """
+    Streams one or more byte ranges of a file. When the ASGI server offers the
+    zero-copy send extension the kernel moves the bytes with sendfile; otherwise
+    ranges are read with pread on the I/O thread pool in DOWNLOAD_CHUNK_SIZE pieces.
+    A single range (or the whole file) is sent as-is, several ranges as
+    multipart/byteranges. Objects stored inline pass their data instead of a
+    path and are sent straight from memory. Compressed files are decompressed
+    on the I/O thread pool one frame at a time, reading only the frames a range
+    overlaps; file_size and the ranges are always in uncompressed bytes.
+
+    The file is opened before the status line is sent: if it was deleted or
+    replaced since the metadata was read (e.g. by a concurrent overwrite), a
+    503 asks the client to retry instead of a 200 cut off after its headers.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        file_size: int,
+        ranges: list[tuple[int, int]] | None,
+        headers: Mapping[str, str],
+        media_type: str,
+        status_code: int = 200,
+        send_body: bool = True,
+        data: bytes | None = None,
+        compression: str | None = None,
+        resource: str = "",
+    ):
+        self.path = path
+        self.resource = resource
+        self.data = data
+        self.compression = compression
+        self._reader = None
+        self.file_size = file_size
+        self.ranges = (ranges or [(0, file_size - 1)]) if file_size else []
+        self.send_body = send_body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self._parts = []
+
+        if ranges and len(ranges) > 1:
+            boundary = uuid.uuid4().hex
+            content_type = f"multipart/byteranges; boundary={boundary}"
+            length = 0
+            for start, end in ranges:
+                preamble = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+                ).encode()
+                self._parts.append((preamble, start, end))
+                length += len(preamble) + (end - start + 1) + 2
+            self._epilogue = f"--{boundary}--\r\n".encode()
+            length += len(self._epilogue)
+        else:
+            content_type = media_type
+            length = sum(end - start + 1 for start, end in self.ranges)
+
+        self.init_headers(headers)
+        self.headers["content-type"] = content_type
+        self.headers["content-length"] = str(length)
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    async def _send_range(self, send: Send, fd: int, start: int, end: int, zero_copy: bool, more_after: bool):
+        if self.data is not None:
+            await send({"type": "http.response.body", "body": self.data[start:end + 1], "more_body": more_after})
+            return
+        if self._reader is not None:
+            slices = self._reader.slices(start, end)
+            for i, (index, lo, hi) in enumerate(slices):
+                frame = await run_blocking(self._reader.read_frame, index)
+                await send({"type": "http.response.body", "body": frame[lo:hi], "more_body": i < len(slices) - 1 or more_after})
+            return
+        remaining = end - start + 1
+        offset = start
+        if zero_copy:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": fd,
+                "offset": offset,
+                "count": remaining,
+                "more_body": more_after,
+            })
+            return
+        while remaining > 0:
+            chunk = await run_blocking(os.pread, fd, min(DOWNLOAD_CHUNK_SIZE, remaining), offset)
+            if not chunk:
+                raise OSError(f"Unexpected end of file while reading {self.path}")
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0 or more_after})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.send_body or not self.ranges:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        fd = None
+        if self.data is None:
+            opened = await run_blocking(_open_object, self.path, self.file_size, self.compression)
+            if opened is None:
+                error_xml = generate_error_response("ServiceUnavailable", "The object changed while it was being read. Please retry.", self.resource)
+                await Response(content=error_xml, media_type="application/xml", status_code=503)(scope, receive, send)
+                return
+            fd, self._reader = opened
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        try:
+            if not self._parts:
+                start, end = self.ranges[0]
+                await self._send_range(send, fd, start, end, zero_copy, more_after=False)
+                return
+            for preamble, start, end in self._parts:
+                await send({"type": "http.response.body", "body": preamble, "more_body": True})
+                await self._send_range(send, fd, start, end, zero_copy, more_after=True)
+                await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            await send({"type": "http.response.body", "body": self._epilogue, "more_body": False})
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+
+class ArchiveResponse(Response):
+    """
+    Streams objects as one tar archive, optionally compressed, without knowing
+    its length up front (the body is sent chunked). objects yields (member name,
+    object) pairs and is consumed as the archive is written, so memory stays
+    bounded however many objects there are. Headers, padding and small objects
+    are coalesced into DOWNLOAD_CHUNK_SIZE sends; the data of larger files is
+    sent with the zero-copy extension when the archive is not compressed, and
+    read with pread on the I/O thread pool otherwise. Objects that disappear
+    or change while the archive is being written are left out.
+    """
+
+    def __init__(
+        self,
+        objects: AsyncIterator[tuple[str, ObjectInfo]],
+        headers: Mapping[str, str],
+        media_type: str,
+        compressor=None,
+    ):
+        self.objects = objects
+        self.compressor = compressor
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self._pending = bytearray()
+        self._send = None
+        self.init_headers(headers)
+
+    async def _emit(self, data: bytes, more_body: bool = True):
+        if self.compressor is not None:
+            data = await run_blocking(self.compressor.compress, data)
+            if not more_body:
+                data += self.compressor.flush()
+            if not data and more_body:
+                return
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _write(self, data: bytes):
+        if not self._pending and len(data) >= DOWNLOAD_CHUNK_SIZE:
+            await self._emit(data)
+            return
+        self._pending += data
+        if len(self._pending) >= DOWNLOAD_CHUNK_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        if self._pending:
+            data = bytes(self._pending)
+            self._pending.clear()
+            await self._emit(data)
+
+    async def _write_file(self, fd: int, reader: FrameReader | None, size: int, zero_copy: bool):
+        if reader is not None:
+            for index in range(-(-size // reader.frame_size)):
+                await self._write(await run_blocking(reader.read_frame, index))
+            return
+        if zero_copy and size >= DOWNLOAD_CHUNK_SIZE:
+            await self._flush()
+            await self._send({"type": "http.response.zerocopysend", "file": fd, "offset": 0, "count": size, "more_body": True})
+            return
+        offset = 0
+        while offset < size:
+            chunk = await run_blocking(os.pread, fd, min(DOWNLOAD_CHUNK_SIZE, size - offset), offset)
+            if not chunk:
+                raise OSError("Unexpected end of file while writing an archive")
+            offset += len(chunk)
+            await self._write(chunk)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._send = send
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        zero_copy = self.compressor is None and "http.response.zerocopysend" in scope.get("extensions", {})
+        async for name, obj in self.objects:
+            if name.endswith("/") and obj.size == 0:
+                await self._write(tarstream.member_header(name, 0, obj.last_modified, directory=True))
+                continue
+            if obj.data is not None:
+                await self._write(tarstream.member_header(name, obj.size, obj.last_modified))
+                await self._write(obj.data)
+                await self._write(tarstream.member_padding(obj.size))
+                continue
+            opened = await run_blocking(_open_object, obj.filepath, obj.size, obj.compression, True)
+            if opened is None:
+                logger.warning("Leaving %s out of an archive: it changed while being archived", obj.name)
+                continue
+            fd, reader = opened
+            try:
+                await self._write(tarstream.member_header(name, obj.size, obj.last_modified))
+                await self._write_file(fd, reader, obj.size, zero_copy)
+            finally:
+                os.close(fd)
+            await self._write(tarstream.member_padding(obj.size))
+        self._pending += tarstream.END_OF_ARCHIVE
+        data = bytes(self._pending)
+        self._pending.clear()
+        await self._emit(data, more_body=False)
@@ -1,70 +1,540 @@
 import os
+import fcntl
 import hashlib
+import tempfile
+import uuid
 from pathlib import Path
+from typing import AsyncIterator, Callable, Iterator
 import shutil
+
+from compression import FrameReader, FrameWriter, read_all, worth_compressing
+from config import STORAGE_LAYOUT, UPLOAD_CHUNK_SIZE
+from integrity import PayloadChecks
+from workers import run_blocking
+
 STORAGE_ROOT = Path("s3_storage")
 STORAGE_ROOT.mkdir(exist_ok=True)
-import shutil
+TMP_ROOT = STORAGE_ROOT / ".tmp"
+# Roots of the sharded layouts, see ShardedLayout and ContentAddressedLayout
+OBJECTS_ROOT = STORAGE_ROOT / ".objects"
+BLOB_ROOT = STORAGE_ROOT / ".blobs"
+
+# ioctl request number for cloning a file's extents (Linux, linux/fs.h)
+_FICLONE = 0x40049409
+
+
+def shard_path(root: Path, name: str) -> Path:
+    """Fans a hex name out over two directory levels, e.g. root/4a/a7/4aa7dc..."""
+    return root / name[:2] / name[2:4] / name
+
+def blob_path(digest: str, compression: str | None = None) -> Path:
+    """
+    Returns the path of a content-addressed blob, named by the SHA-256 of its
+    uncompressed data. Compressed and uncompressed copies of the same data are
+    different blobs, so the name of a compressed one ends in its algorithm.
+    """
+    return shard_path(BLOB_ROOT, f"{digest}.{compression}" if compression else digest)
+
+def data_sha256(filepath: str, compression: str | None = None) -> str:
+    """Hashes a stored object's uncompressed data, which is what blobs are named by."""
+    sha256 = hashlib.sha256()
+    if compression:
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            reader = FrameReader(fd, compression)
+            for data in reader.read(0, reader.logical_size - 1) if reader.logical_size else ():
+                sha256.update(data)
+        finally:
+            os.close(fd)
+        return sha256.hexdigest()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def is_blob_path(filepath: str) -> bool:
+    """True if filepath is a shared, reference-counted blob rather than a file owned by one object."""
+    return Path(filepath).is_relative_to(BLOB_ROOT)
+
+def is_inline(filepath: str) -> bool:
+    """True if the object's data is stored inline in the metadata database rather than in a file."""
+    return not filepath
+
+class ObjectWriter:
+    """
+    Incrementally writes an upload to a temporary file, hashing it as it goes:
+    MD5 for the ETag, plus whatever digests the client declared in checks, all
+    in the same pass. The data only becomes visible at its final path once
+    commit() has verified it and atomically renamed the temporary file into place.
+
+    Without a final_path the upload is content-addressed: its path is derived
+    from the SHA-256 of the data, and if a blob with that content already exists
+    the new copy is simply dropped.
+
+    With a compression algorithm the data is stored as compressed frames (see
+    compression.FrameWriter), unless the first chunk shows it is not worth it,
+    in which case compression is reset to None. Digests, size and ETag are
+    always those of the uncompressed data; stored_size is the file's size.
+    """
+
+    def __init__(self, final_path: Path | None, checks: PayloadChecks | None = None, compression: str | None = None, content_type: str | None = None):
+        self.final_path = final_path
+        self.checks = checks or PayloadChecks()
+        self.compression = compression
+        self.content_type = content_type
+        self.size = 0
+        self._frames = None
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256() if self.checks.sha256 or final_path is None else None
+        self._checksum = self.checks.new_checksum()
+        TMP_ROOT.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=TMP_ROOT, prefix="upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def stored_size(self) -> int:
+        return self._frames.stored_size if self._frames else self.size
+
+    def write(self, chunk: bytes):
+        if self.compression and self._frames is None:
+            # Decided once, on the first chunk
+            if worth_compressing(self.compression, self.content_type, chunk):
+                self._frames = FrameWriter(self._file, self.compression)
+            else:
+                self.compression = None
+        (self._frames or self._file).write(chunk)
+        self._md5.update(chunk)
+        if self._sha256:
+            self._sha256.update(chunk)
+        if self._checksum:
+            self._checksum.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, before_place: Callable[[str, int], None] | None = None) -> tuple[int, str]:
+        """
+        Closes the temp file, verifies it and moves it to its final path.
+        For content-addressed uploads, before_place(path, size) is called once
+        the blob path is known but before the data is placed or deduplicated,
+        so the caller can take a reference on the blob first; that way the
+        garbage collector can never remove a blob this upload relies on.
+        """
+        if self._frames:
+            self._frames.close()
+        else:
+            self.compression = None
+        self._file.close()
+        try:
+            self.checks.verify(self._md5, self._sha256, self._checksum)
+        except Exception:
+            self.abort()
+            raise
+        if self.final_path is None:
+            self.final_path = blob_path(self._sha256.hexdigest(), self.compression)
+            if before_place:
+                before_place(str(self.final_path), self.stored_size)
+            if self.final_path.exists():
+                # Identical content is already stored: keep a single copy
+                self.abort()
+                return self.size, self._md5.hexdigest()
+        self.final_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self._tmp_path, self.final_path)
+        return self.size, self._md5.hexdigest()
+
+    def abort(self):
+        """Discards everything written so far."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+async def _receive_stream(stream: AsyncIterator[bytes], writer: ObjectWriter, before_place: Callable[[str, int], None] | None = None) -> tuple[int, str]:
+    """Drains a request body stream into the writer in UPLOAD_CHUNK_SIZE pieces."""
+    buffer = bytearray()
+    try:
+        async for chunk in stream:
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_blocking(writer.write, buffer)
+                buffer.clear()
+        if buffer:
+            await run_blocking(writer.write, buffer)
+        return await run_blocking(writer.commit, before_place)
+    except BaseException:
+        await run_blocking(writer.abort)
+        raise
 
 def create_bucket_folder(bucket_name: str):
     (STORAGE_ROOT / bucket_name).mkdir(exist_ok=True)
 
-def save_object(bucket_name: str, object_name: str, data: bytes) -> tuple[int, str]:
-    obj_path = STORAGE_ROOT / bucket_name / object_name
-    obj_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(obj_path, "wb") as f:
-        f.write(data)
-    
-    size = len(data)
-    etag = hashlib.md5(data).hexdigest()
-    return size, etag
-
-def save_part(upload_id: str, part_number: int, data: bytes) -> tuple[str, str]:
-    part_dir = STORAGE_ROOT / ".tmp" / upload_id
-    part_dir.mkdir(parents=True, exist_ok=True)
-    filepath = part_dir / f"part.{part_number}"
-    with open(filepath, "wb") as f:
-        f.write(data)
-    
-    etag = hashlib.md5(data).hexdigest()
-    return str(filepath), etag
-
-def combine_parts(bucket_name: str, object_name: str, parts: list) -> tuple[int, str]:
-    final_path = STORAGE_ROOT / bucket_name / object_name
+class PathLayout:
+    """
+    Stores each object at s3_storage/<bucket>/<key>, mirroring the key on the
+    filesystem. Kept for existing trees; large flat buckets become huge directories.
+    Every version of a key is written to the same path, so new data replaces
+    the current version's as soon as it is placed.
+    """
+    content_addressed = False
+    in_place = True
+
+    def object_path(self, bucket_name: str, object_name: str) -> Path:
+        return STORAGE_ROOT / bucket_name / object_name
+
+class ShardedLayout:
+    """
+    Stores each object under a random ID in s3_storage/.objects, fanned out over
+    two levels of hex shard directories, so no directory holds more than a few
+    hundred entries. The key to path mapping only lives in the metadata
+    database, so key names never touch the filesystem.
+    """
+    content_addressed = False
+    in_place = False
+    root = OBJECTS_ROOT
+
+    def object_path(self, bucket_name: str, object_name: str) -> Path:
+        return shard_path(self.root, uuid.uuid4().hex)
+
+class ContentAddressedLayout(ShardedLayout):
+    """
+    Stores uploads as deduplicated blobs named by the SHA-256 of their data.
+    Data that is not hashed while it is written (e.g. completed multipart
+    uploads) gets a unique blob name instead.
+    """
+    content_addressed = True
+    root = BLOB_ROOT
+
+LAYOUTS = {
+    "path": PathLayout,
+    "sharded": ShardedLayout,
+    "cas": ContentAddressedLayout,
+}
+layout = LAYOUTS[STORAGE_LAYOUT]()
+
+def object_path(bucket_name: str, object_name: str) -> Path:
+    """Returns where newly written data for an object should be stored on disk."""
+    return layout.object_path(bucket_name, object_name)
+
+def _new_object_path(bucket_name: str, object_name: str, staged: bool) -> Path | None:
+    """The path an ObjectWriter writes to: None for content-addressed data, see save_object for staged."""
+    if layout.content_addressed:
+        return None
+    if staged and layout.in_place:
+        return TMP_ROOT / f"staged-{uuid.uuid4().hex}"
+    return object_path(bucket_name, object_name)
+
+def place_staged(staged_path: str, filepath: str):
+    """Moves data written with staged=True onto the object path it was written for."""
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    os.replace(staged_path, filepath)
+
+async def save_object(
+    bucket_name: str,
+    object_name: str,
+    stream: AsyncIterator[bytes],
+    checks: PayloadChecks | None = None,
+    before_place: Callable[[str, int], None] | None = None,
+    compression: str | None = None,
+    content_type: str | None = None,
+    staged: bool = False,
+) -> tuple[int, str, str, str | None, int]:
+    """
+    Streams an object body to disk and returns (size, etag, filepath,
+    compression, stored_size): compression is the algorithm the data was stored
+    with, if compression was requested and the data compresses. With the
+    content-addressed layout, before_place is forwarded to ObjectWriter.commit().
+
+    With staged, data the layout would write over the key's current version
+    (PathLayout) goes to a unique temporary path instead, returned as filepath;
+    place_staged() moves it to object_path() once the caller has committed it.
+    """
+    obj_path = _new_object_path(bucket_name, object_name, staged)
+    writer = await run_blocking(ObjectWriter, obj_path, checks, compression, content_type)
+    size, etag = await _receive_stream(stream, writer, before_place)
+    return size, etag, str(writer.final_path), writer.compression, writer.stored_size
+
+def write_object(
+    bucket_name: str,
+    object_name: str,
+    data: bytes,
+    before_place: Callable[[str, int], None] | None = None,
+    compression: str | None = None,
+    content_type: str | None = None,
+    staged: bool = False,
+) -> tuple[int, str, str, str | None, int]:
+    """
+    Writes an object from data already in memory, e.g. a member of a bulk
+    upload, in a single call on the calling thread. Takes and returns the same
+    values as save_object.
+    """
+    obj_path = _new_object_path(bucket_name, object_name, staged)
+    writer = ObjectWriter(obj_path, None, compression, content_type)
+    try:
+        writer.write(data)
+        size, etag = writer.commit(before_place)
+    except BaseException:
+        writer.abort()
+        raise
+    return size, etag, str(writer.final_path), writer.compression, writer.stored_size
+
+def part_path(upload_id: str, part_number: int) -> Path:
+    """
+    Every upload of a part gets a file of its own, so concurrent uploads of the
+    same part number never write to the same path; the one recorded last wins.
+    """
+    return TMP_ROOT / upload_id / f"part.{part_number}.{uuid.uuid4().hex}"
+
+async def save_part(upload_id: str, part_number: int, stream: AsyncIterator[bytes], checks: PayloadChecks | None = None) -> tuple[str, str, int]:
+    """Streams an UploadPart body to its own part file. Returns (filepath, etag, size)."""
+    filepath = part_path(upload_id, part_number)
+    writer = await run_blocking(ObjectWriter, filepath, checks)
+    size, etag = await _receive_stream(stream, writer)
+    return str(filepath), etag, size
+
+def _copy_range(src_file, dst_file, offset: int, count: int) -> int:
+    """
+    Copies count bytes starting at offset in src_file to the current end of
+    dst_file inside the kernel, without pulling the data through user space.
+    copy_file_range can share extents on filesystems that support reflinks;
+    sendfile and a buffered copy are fallbacks.
+    """
+    dst_file.seek(0, os.SEEK_END)
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+    copied = 0
+    try:
+        while copied < count:
+            if hasattr(os, "copy_file_range"):
+                n = os.copy_file_range(src_fd, dst_fd, count - copied, offset + copied)
+            else:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, count - copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError:
+        # Cross-device or unsupported: finish with a plain buffered copy
+        src_file.seek(offset + copied)
+        dst_file.seek(0, os.SEEK_END)
+        while copied < count:
+            chunk = src_file.read(min(UPLOAD_CHUNK_SIZE, count - copied))
+            if not chunk:
+                break
+            dst_file.write(chunk)
+            copied += len(chunk)
+        dst_file.flush()
+    return copied
+
+def _append_file(src_path: str, dst_file) -> int:
+    """Appends the whole contents of src_path to dst_file in-kernel."""
+    with open(src_path, "rb") as src:
+        return _copy_range(src, dst_file, 0, os.fstat(src.fileno()).st_size)
+
+def _clone_into_tmp(src_path: str) -> str:
+    """
+    Makes a private copy of src_path in the temp area and returns its path.
+    A reflink (FICLONE) is tried first, which shares the data blocks and is a
+    metadata-only operation on btrfs/XFS; other filesystems fall back to an
+    in-kernel copy.
+    """
+    TMP_ROOT.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_ROOT, prefix="copy-")
+    try:
+        with open(src_path, "rb") as src, os.fdopen(fd, "r+b") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            except OSError:
+                _copy_range(src, dst, 0, os.fstat(src.fileno()).st_size)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def link_into_place(src_path: str, final_path: Path):
+    """
+    Makes the data of src_path available at final_path as well, without copying
+    it where possible. Stored files are never modified in place (writers always
+    replace them), so a hard link is as good as a copy.
+    """
+    TMP_ROOT.mkdir(parents=True, exist_ok=True)
+    tmp_path = os.path.join(TMP_ROOT, f"link-{uuid.uuid4().hex}")
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        tmp_path = _clone_into_tmp(src_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, final_path)
+
+def copy_object(
+    src_path: str,
+    bucket_name: str,
+    object_name: str,
+    compression: str | None = None,
+    before_place: Callable[[str, int], None] | None = None,
+) -> tuple[int, str]:
+    """
+    Server-side copy of a stored object to a new key. Returns (size, filepath),
+    where size is that of the file: a compressed object (compression being its
+    algorithm) is copied as it is stored. A content-addressed blob is shared
+    rather than copied, so the copy is a metadata-only operation for the caller
+    to record. With the content-addressed layout, any other source (e.g. one
+    written before switching layouts) is turned into a blob named as
+    ObjectWriter would name it, and before_place is called as in
+    ObjectWriter.commit() so the blob is referenced before it is placed.
+    """
+    if is_blob_path(src_path):
+        return os.path.getsize(src_path), src_path
+    if layout.content_addressed:
+        final_path = blob_path(data_sha256(src_path, compression), compression)
+        size = os.path.getsize(src_path)
+        if before_place:
+            before_place(str(final_path), size)
+        if not final_path.exists():
+            link_into_place(src_path, final_path)
+        return size, str(final_path)
+    final_path = object_path(bucket_name, object_name)
+    tmp_path = _clone_into_tmp(src_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, final_path)
+    return os.path.getsize(final_path), str(final_path)
+
+def read_range(src_path: str, start: int, end: int, compression: str | None = None) -> Iterator[bytes]:
+    """
+    Yields the inclusive byte range [start, end] of a stored object's data in
+    pieces of at most UPLOAD_CHUNK_SIZE, or one decompressed frame at a time if
+    it is compressed.
+    """
+    with open(src_path, "rb") as src:
+        if compression:
+            yield from FrameReader(src.fileno(), compression).read(start, end)
+            return
+        src.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = src.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            yield chunk
+            remaining -= len(chunk)
+
+def copy_part(
+    src_path: str,
+    upload_id: str,
+    part_number: int,
+    start: int,
+    end: int,
+    src_etag: str | None = None,
+    compression: str | None = None,
+) -> tuple[str, str, int]:
+    """
+    Server-side UploadPartCopy of the inclusive byte range [start, end] of a
+    stored object. When the range is the whole object, its MD5 is already
+    known (src_etag) and it is not compressed, the data is cloned in-kernel;
+    otherwise it is copied (decompressed, as parts are stored uncompressed) in a
+    single pass that also computes the part's MD5. Returns (filepath, etag, size).
+    """
+    filepath = part_path(upload_id, part_number)
+    if src_etag is not None and compression is None:
+        tmp_path = _clone_into_tmp(src_path)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, filepath)
+        return str(filepath), src_etag, end - start + 1
+
+    writer = ObjectWriter(filepath)
+    try:
+        for chunk in read_range(src_path, start, end, compression):
+            writer.write(chunk)
+        size, etag = writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    return str(filepath), etag, size
+
+def write_part(upload_id: str, part_number: int, data: bytes) -> tuple[str, str, int]:
+    """Writes a part from data already in memory, e.g. copied from an inline object. Returns (filepath, etag, size)."""
+    filepath = part_path(upload_id, part_number)
+    writer = ObjectWriter(filepath)
+    try:
+        writer.write(data)
+        size, etag = writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    return str(filepath), etag, size
+
+def verify_part(filepath: str, expected_size: int | None) -> int | None:
+    """
+    Checks that a recorded part file is still present and has the size recorded
+    for it. Returns its size, or None if it is missing or was truncated.
+    """
+    try:
+        size = os.path.getsize(filepath)
+    except OSError:
+        return None
+    return size if expected_size is None or size == expected_size else None
+
+def combine_parts(bucket_name: str, object_name: str, parts: list, part_sizes: list[int]) -> tuple[int, str, list[int], str]:
+    """
+    Assembles the final object from its parts, which must be ordered by part
+    number and already verified (see verify_part). The first part file is renamed
+    into place and the remaining parts are appended to it in-kernel, so no part
+    is read into memory. The multipart ETag is derived from the part ETags
+    already recorded at upload time instead of re-hashing the data.
+    Returns (size, etag, part_sizes, filepath).
+    """
+    final_path = object_path(bucket_name, object_name)
     final_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    total_size = 0
-    md5s = []
-
-    with open(final_path, "wb") as final_file:
-        # Sort parts by part number before combining
-        parts.sort(key=lambda p: p.part_number)
-        for part in parts:
-            with open(part.filepath, "rb") as part_file:
-                data = part_file.read()
-                final_file.write(data)
-                total_size += len(data)
-                md5s.append(hashlib.md5(data).digest())
-            os.remove(part.filepath)
-    
+
+    fd, assembly_path = tempfile.mkstemp(dir=TMP_ROOT, prefix="complete-")
+    os.close(fd)
+    try:
+        os.replace(parts[0].filepath, assembly_path)
+    except BaseException:
+        # E.g. the part was uploaded again or aborted meanwhile: don't leave the temp file behind
+        os.remove(assembly_path)
+        raise
+
+    try:
+        # Not opened in append mode: copy_file_range rejects O_APPEND descriptors
+        with open(assembly_path, "r+b") as final_file:
+            final_file.seek(0, os.SEEK_END)
+            for part in parts[1:]:
+                _append_file(part.filepath, final_file)
+            total_size = final_file.seek(0, os.SEEK_END)
+    except BaseException:
+        # Put the first part back as it was, so the upload can still be completed
+        os.truncate(assembly_path, part_sizes[0])
+        os.replace(assembly_path, parts[0].filepath)
+        raise
+    os.replace(assembly_path, final_path)
+
     # Calculate multipart ETag
-    digests = b"".join(md5s)
-    etag = f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+    digests = b"".join(bytes.fromhex(part.etag) for part in parts)
+    etag = f"{hashlib.md5(digests).hexdigest()}-{len(parts)}"
 
     # Cleanup
-    tmp_dir = STORAGE_ROOT / ".tmp" / parts[0].upload_id
-    if os.path.exists(tmp_dir) and not os.listdir(tmp_dir):
-        os.rmdir(tmp_dir)
+    cleanup_parts(parts[0].upload_id)
         
-    return total_size, etag
+    return total_size, etag, part_sizes, str(final_path)
+
 def cleanup_parts(upload_id: str):
     """Deletes the temporary directory for a given multipart upload."""
-    part_dir = STORAGE_ROOT / ".tmp" / upload_id
+    part_dir = TMP_ROOT / upload_id
     if part_dir.exists():
         shutil.rmtree(part_dir)
 
+def read_object(filepath: str, compression: str | None = None) -> bytes:
+    """Reads a whole object's (uncompressed) data into memory, for caching small objects."""
+    if compression:
+        return read_all(filepath, compression)
+    with open(filepath, "rb") as f:
+        return f.read()
+
 def delete_object(filepath: str):
-    """Deletes the physical object file from the storage."""
+    """
+    Deletes the physical object file from the storage. Shared blobs are left to
+    the garbage collector, which removes them once no object references them,
+    and inline objects have no file.
+    """
+    if is_inline(filepath) or is_blob_path(filepath):
+        return
     try:
         if os.path.exists(filepath):
             os.remove(filepath)
@@ -82,4 +552,15 @@ def delete_bucket_folder(bucket_name: str):
             shutil.rmtree(bucket_path)
         except OSError as e:
             print(f"Error removing bucket folder {bucket_path}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+def delete_blob(filepath: str):
+    """
+    Removes an unreferenced blob file. Shard directories are kept: there are at
+    most 65536 of them, and removing one could race with a writer placing a new
+    blob in it.
+    """
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,207 @@
+import calendar
+import tarfile
+import zlib
+from datetime import datetime
+from typing import AsyncIterator
+
+import compression
+from config import UPLOAD_CHUNK_SIZE
+from integrity import IntegrityError
+from workers import run_blocking
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# Member types extracted as objects; other members are skipped
+FILE_TYPES = (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE)
+# Member types whose size field does not describe data stored in the archive
+NO_DATA_TYPES = (tarfile.DIRTYPE, tarfile.LNKTYPE, tarfile.SYMTYPE, tarfile.CHRTYPE, tarfile.BLKTYPE, tarfile.FIFOTYPE)
+GZIP_MAGIC = b"\x1f\x8b"
+# Two zero blocks end an archive
+END_OF_ARCHIVE = b"\0" * (2 * BLOCK_SIZE)
+# Compressions a streamed archive can be wrapped in, with their content types
+ARCHIVE_COMPRESSIONS = {None: "application/x-tar", "gzip": "application/gzip", "zstd": "application/zstd"}
+
+
+def _padded(size: int) -> int:
+    return -(-size // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def _parse_pax(data: bytes) -> dict[str, str]:
+    """Parses the "<length> <key>=<value>\\n" records of a pax extended header."""
+    records = {}
+    pos = 0
+    while pos < len(data) and data[pos] != 0:
+        length_field, sep, _ = data[pos:pos + 32].partition(b" ")
+        try:
+            length = int(length_field)
+        except ValueError:
+            length = 0
+        if not sep or length <= len(length_field) + 1:
+            raise IntegrityError("InvalidRequest", "The archive has a malformed pax header.")
+        key, _, value = data[pos + len(length_field) + 1:pos + length - 1].partition(b"=")
+        records[key.decode("utf-8", "surrogateescape")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return records
+
+
+async def _gunzip(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Inflates a gzip stream (possibly several concatenated members) on the I/O thread pool."""
+    inflater = zlib.decompressobj(wbits=31)
+    unfinished = False
+    async for data in stream:
+        while data:
+            unfinished = True
+            out = await run_blocking(inflater.decompress, data, UPLOAD_CHUNK_SIZE)
+            if out:
+                yield out
+            if inflater.eof:
+                data = inflater.unused_data
+                inflater = zlib.decompressobj(wbits=31)
+                unfinished = False
+            else:
+                data = inflater.unconsumed_tail
+    if unfinished:
+        raise IntegrityError("IncompleteBody", "The gzip stream ended unexpectedly.")
+
+
+class TarReader:
+    """
+    Reads a tar archive (ustar, GNU or pax; optionally gzip-compressed) from an
+    async byte stream, one member at a time, without seeking. A member's data
+    must be consumed with read_data() or iter_data() before asking for the
+    next member; only a chunk of the stream is buffered at any time.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._stream = aiter(stream)
+        self._buffer = bytearray()
+        self._sniffed = False
+        self._remaining = 0  # Data bytes of the current member not read yet
+        self._padding = 0  # Bytes after them up to the next header
+
+    async def _fill(self) -> bool:
+        try:
+            chunk = await anext(self._stream)
+        except StopAsyncIteration:
+            return False
+        if not self._sniffed:
+            self._sniffed = True
+            while len(chunk) < len(GZIP_MAGIC):
+                try:
+                    chunk += await anext(self._stream)
+                except StopAsyncIteration:
+                    break
+            if chunk.startswith(GZIP_MAGIC):
+                self._stream = _gunzip(_prepend(chunk, self._stream))
+                return await self._fill()
+        self._buffer += chunk
+        return True
+
+    async def _read(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            if not await self._fill():
+                raise IntegrityError("IncompleteBody", "The archive ended in the middle of a member.")
+        data = bytes(memoryview(self._buffer)[:n])
+        del self._buffer[:n]
+        return data
+
+    async def _skip(self, n: int):
+        while n:
+            if not self._buffer and not await self._fill():
+                raise IntegrityError("IncompleteBody", "The archive ended in the middle of a member.")
+            step = min(n, len(self._buffer))
+            del self._buffer[:step]
+            n -= step
+
+    async def next_member(self) -> tarfile.TarInfo | None:
+        """
+        Returns the header of the next regular file, with any pax or GNU long
+        name already applied, or None at the end of the archive.
+        """
+        await self._skip(self._remaining + self._padding)
+        self._remaining = self._padding = 0
+        pax = {}
+        long_name = None
+        while True:
+            if not self._buffer and not await self._fill():
+                return None  # No end-of-archive marker, which some writers omit
+            block = await self._read(BLOCK_SIZE)
+            try:
+                info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+            except tarfile.EOFHeaderError:
+                return None
+            except tarfile.HeaderError:
+                raise IntegrityError("InvalidRequest", "The request body is not a valid tar archive.")
+
+            if info.type in (tarfile.XHDTYPE, tarfile.SOLARIS_XHDTYPE):
+                pax.update(_parse_pax((await self._read(_padded(info.size)))[:info.size]))
+                continue
+            if info.type == tarfile.GNUTYPE_LONGNAME:
+                long_name = (await self._read(_padded(info.size)))[:info.size].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                continue
+            if "path" in pax or long_name is not None:
+                info.name = pax.get("path") or long_name
+            if "size" in pax:
+                info.size = int(pax["size"])
+            if info.type not in FILE_TYPES:
+                # Directories, links, devices, global headers: nothing to extract
+                await self._skip(0 if info.type in NO_DATA_TYPES else _padded(info.size))
+                pax, long_name = {}, None
+                continue
+            self._remaining = info.size
+            self._padding = _padded(info.size) - info.size
+            return info
+
+    async def iter_data(self) -> AsyncIterator[bytes]:
+        """Yields the current member's data in pieces as they arrive."""
+        while self._remaining:
+            if not self._buffer and not await self._fill():
+                raise IntegrityError("IncompleteBody", "The archive ended in the middle of a member.")
+            piece = bytes(memoryview(self._buffer)[:self._remaining])
+            del self._buffer[:len(piece)]
+            self._remaining -= len(piece)
+            yield piece
+
+    async def read_data(self) -> bytes:
+        """Returns the current member's data in one piece, for small members."""
+        data = await self._read(self._remaining)
+        self._remaining = 0
+        return data
+
+    async def drain(self):
+        """Reads the rest of the stream (e.g. padding after the end marker), so it is fully verified."""
+        self._buffer.clear()
+        while await self._fill():
+            self._buffer.clear()
+
+
+async def _prepend(first: bytes, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield first
+    async for chunk in stream:
+        yield chunk
+
+
+def member_header(name: str, size: int, mtime: datetime, directory: bool = False) -> bytes:
+    """
+    Returns the header block(s) of an archive member. Names that don't fit a
+    ustar header, and sizes of 8 GiB or more, get a pax extended header.
+    """
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE if directory else tarfile.REGTYPE
+    info.mode = 0o755 if directory else 0o644
+    info.size = 0 if directory else size
+    info.mtime = calendar.timegm(mtime.utctimetuple())
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def member_padding(size: int) -> bytes:
+    """Returns the zero bytes that pad a member's data to a whole block."""
+    return b"\0" * (_padded(size) - size)
+
+
+def archive_compressor(algorithm: str | None):
+    """Returns a streaming compressor (compress()/flush()) for an archive, or None for a plain tar."""
+    if algorithm == "gzip":
+        return zlib.compressobj(1, zlib.DEFLATED, 31)  # Fast level: the download should keep up with the disk
+    if algorithm == "zstd":
+        return compression.zstandard.ZstdCompressor(level=3).compressobj()
+    return None
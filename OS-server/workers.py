@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+import metrics
+from config import IO_THREAD_POOL_SIZE
+
+# Dedicated pool for blocking disk and database work issued from async handlers,
+# so a large write or a slow commit never stalls the event loop.
+executor = ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="s3-io")
+
+_lock = threading.Lock()
+_submitted = 0
+_running = 0
+
+
+def _tracked(func: Callable[[], Any]) -> Any:
+    global _running
+    with _lock:
+        _running += 1
+    try:
+        return func()
+    finally:
+        with _lock:
+            _running -= 1
+
+
+def _task_done(_future):
+    global _submitted
+    with _lock:
+        _submitted -= 1
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs a blocking callable on the I/O thread pool and awaits its result. Its time counts as disk I/O."""
+    global _submitted
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _submitted += 1
+    future = loop.run_in_executor(executor, _tracked, partial(func, *args, **kwargs))
+    future.add_done_callback(_task_done)
+    with metrics.phase("disk"):
+        return await future
+
+
+def pool_stats() -> dict:
+    """Returns a snapshot of the I/O thread pool's size and saturation."""
+    with _lock:
+        return {
+            "size": IO_THREAD_POOL_SIZE,
+            "active": _running,
+            "queued": max(_submitted - _running, 0),
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# --- Configuration ---
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", 1000))  # Requests in flight at once
+REQUESTS = int(os.getenv("BENCH_REQUESTS", 20000))
+OBJECTS = 1000
+
+# Run against a scratch database so a real s3_metadata.db is never touched
+workdir = tempfile.mkdtemp(prefix="bench-metadata-")
+os.chdir(workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OS-server"))
+
+import crud
+import migrations
+import models
+from database import AsyncSessionLocal, SessionLocal, engine
+from sqlalchemy import select
+from workers import run_blocking
+
+# --- Helper Functions ---
+
+def setup():
+    """Creates one bucket holding OBJECTS objects."""
+    migrations.run_migrations(engine)
+    db = SessionLocal()
+    bucket = models.Bucket(name="bench", owner_id=1)
+    db.add(bucket)
+    db.flush()
+    for i in range(OBJECTS):
+        db.add(models.Object(name=f"key-{i}", bucket_id=bucket.id, size=4096, etag="0" * 32, filepath=f"/dev/null/{i}"))
+    db.commit()
+    bucket_id = bucket.id
+    db.close()
+    return bucket_id
+
+def sync_lookup(bucket_id: int, i: int):
+    """The request path before the async port: a sync session on the I/O thread pool."""
+    db = SessionLocal()
+    try:
+        return db.scalar(select(models.Object).where(models.Object.bucket_id == bucket_id, models.Object.name == f"key-{i % OBJECTS}"))
+    finally:
+        db.close()
+
+async def async_lookup(bucket_id: int, i: int):
+    """The current request path: an async session on the event loop."""
+    async with AsyncSessionLocal() as db:
+        return await crud.get_object_by_bucket_and_name(db, bucket_id, f"key-{i % OBJECTS}")
+
+async def run(name: str, request):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            assert await request(i) is not None
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{name:<6} {REQUESTS / elapsed:8.0f} lookups/s  "
+        f"p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms  "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms"
+    )
+
+async def main():
+    bucket_id = setup()
+    print(f"--- {REQUESTS} object lookups, {CONCURRENCY} in flight ---")
+    await run("sync", lambda i: run_blocking(sync_lookup, bucket_id, i))
+    await run("async", lambda i: async_lookup(bucket_id, i))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,296 @@
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+# --- Configuration ---
+S3_ENDPOINT_URL = os.getenv("BENCH_ENDPOINT", "http://127.0.0.1:9000")
+S3_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
+S3_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
+S3_REGION = "us-east-1"
+
+SCENARIOS = ("put", "get", "head", "multipart", "list", "delete")
+UNITS = {"": 1, "b": 1, "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3}
+# Keys per archive when seeding the list scenario through bulk ingest
+LIST_SEED_BATCH = 10000
+
+# --- Helper Functions ---
+
+def parse_size(text: str) -> int:
+    """Parses sizes such as 4096, 64KiB or 8MiB."""
+    text = text.strip().lower()
+    number = text.rstrip("kmgib")
+    return int(float(number) * UNITS[text[len(number):]])
+
+def parse_mix(text: str) -> list[tuple[int, int]]:
+    """Parses an object-size mix such as "4KiB:70,64KiB:25,1MiB:5" into (size, weight) pairs."""
+    mix = []
+    for entry in text.split(","):
+        size, _, weight = entry.partition(":")
+        mix.append((parse_size(size), int(weight or 1)))
+    return mix
+
+def seed_archive(keys: list[str]) -> bytes:
+    """Builds a tar archive of empty files named keys, to be extracted by bulk ingest."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for key in keys:
+            archive.addfile(tarfile.TarInfo(key))
+    return buffer.getvalue()
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if latencies else 0.0
+
+def peak_rss_mb(pid: int | None = None) -> float | None:
+    """Peak resident set size of this process, or of another local process by PID."""
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+def run_scenario(name: str, operations: list, concurrency: int) -> dict:
+    """
+    Runs the callables in operations on concurrency threads. Each returns the
+    number of payload bytes it moved. Reports throughput and latency.
+    """
+    latencies = []
+    errors = 0
+    transferred = 0
+    lock = threading.Lock()
+
+    def one(operation):
+        nonlocal errors, transferred
+        start = time.perf_counter()
+        try:
+            moved = operation()
+        except Exception as e:
+            with lock:
+                errors += 1
+                report = errors <= 3
+            if report:
+                print(f"  {name}: {e}", file=sys.stderr)
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            transferred += moved
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, operations))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    result = {
+        "requests": len(operations),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "ops_per_sec": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "mib_per_sec": round(transferred / seconds / 1024 ** 2, 2) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+    print(
+        f"{name:<10} {result['ops_per_sec']:9.1f} ops/s {result['mib_per_sec']:8.2f} MiB/s  "
+        f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  errors {errors}",
+        file=sys.stderr,
+    )
+    return result
+
+def start_in_process_server(port: int) -> str:
+    """
+    Starts the server on a background thread of this process, against a
+    scratch data directory, and returns its endpoint.
+    """
+    import uvicorn
+
+    workdir = tempfile.mkdtemp(prefix="bench-s3-")
+    os.chdir(workdir)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/s3_metadata.db")
+    os.environ.setdefault("ACCESS_LOG", "false")
+    os.environ.setdefault("MINIO_ACCESS_KEY", S3_ACCESS_KEY)
+    os.environ.setdefault("MINIO_SECRET_KEY", S3_SECRET_KEY)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OS-server"))
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    print(f"In-process server on port {port}, data in {workdir}", file=sys.stderr)
+    return f"http://127.0.0.1:{port}"
+
+# --- Main Script ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the S3 endpoints. Prints results as JSON.")
+    parser.add_argument("--in-process", action="store_true", help="start the server inside this process on a scratch directory instead of using BENCH_ENDPOINT")
+    parser.add_argument("--port", type=int, default=9100, help="port for --in-process")
+    parser.add_argument("--server-pid", type=int, help="PID of a local server, to report its peak RSS")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--objects", type=int, default=2000, help="small objects for put/get/head/delete")
+    parser.add_argument("--size-mix", default="4KiB:70,64KiB:25,1MiB:5", help="small-object sizes with weights")
+    parser.add_argument("--multipart-count", type=int, default=4, help="large objects uploaded with multipart")
+    parser.add_argument("--multipart-size", default="64MiB", help="size of each large object")
+    parser.add_argument("--part-size", default="8MiB", help="multipart part size")
+    parser.add_argument("--list-keys", type=int, default=10000, help="keys in the bucket that is listed (e.g. 1000000)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the size mix")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    endpoint = start_in_process_server(args.port) if args.in_process else S3_ENDPOINT_URL
+    s3_client = boto3.client(
+        "s3",
+        endpoint_url=endpoint,
+        aws_access_key_id=S3_ACCESS_KEY,
+        aws_secret_access_key=S3_SECRET_KEY,
+        region_name=S3_REGION,
+        config=Config(max_pool_connections=args.concurrency, retries={"max_attempts": 0}),
+    )
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.size_mix)
+    sizes = rng.choices([size for size, _ in mix], weights=[weight for _, weight in mix], k=args.objects)
+    payloads = {size: os.urandom(size) for size, _ in mix}
+    keys = [f"obj/{i:08d}" for i in range(args.objects)]
+    bucket = f"bench-{uuid.uuid4().hex[:12]}"
+    s3_client.create_bucket(Bucket=bucket)
+
+    results = {}
+    print(f"--- Benchmarking {endpoint}, {args.concurrency} in flight, bucket {bucket} ---", file=sys.stderr)
+
+    if "put" in scenarios or any(name in scenarios for name in ("get", "head", "delete")):
+        def put(key, size):
+            s3_client.put_object(Bucket=bucket, Key=key, Body=payloads[size])
+            return size
+        put_result = run_scenario("put", [lambda k=k, s=s: put(k, s) for k, s in zip(keys, sizes)], args.concurrency)
+        if "put" in scenarios:
+            results["put"] = put_result
+
+    if "get" in scenarios:
+        def get(key):
+            return len(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+        results["get"] = run_scenario("get", [lambda k=k: get(k) for k in keys], args.concurrency)
+
+    if "head" in scenarios:
+        def head(key):
+            s3_client.head_object(Bucket=bucket, Key=key)
+            return 0
+        results["head"] = run_scenario("head", [lambda k=k: head(k) for k in keys], args.concurrency)
+
+    if "multipart" in scenarios:
+        object_size, part_size = parse_size(args.multipart_size), parse_size(args.part_size)
+        part = os.urandom(part_size)
+
+        def upload(key):
+            upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+            part_count = -(-object_size // part_size)
+            # Parts go out concurrently, like a real client's transfer manager would send them
+            with ThreadPoolExecutor(max_workers=min(part_count, 8)) as pool:
+                etags = list(pool.map(
+                    lambda n: s3_client.upload_part(
+                        Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n,
+                        Body=part[:min(part_size, object_size - (n - 1) * part_size)],
+                    )["ETag"],
+                    range(1, part_count + 1),
+                ))
+            s3_client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": n, "ETag": etag} for n, etag in enumerate(etags, 1)]},
+            )
+            return object_size
+        results["multipart"] = run_scenario(
+            "multipart",
+            [lambda i=i: upload(f"large/{i:04d}") for i in range(args.multipart_count)],
+            max(1, min(args.concurrency, args.multipart_count)),
+        )
+
+    if "list" in scenarios:
+        list_bucket = f"{bucket}-list"
+        s3_client.create_bucket(Bucket=list_bucket)
+
+        # Seeded through bulk ingest: one PUT per key would take far longer than the listing
+        def seed(start):
+            keys = [f"dir-{i % 100:02d}/key-{i:08d}" for i in range(start, min(start + LIST_SEED_BATCH, args.list_keys))]
+            body = seed_archive(keys)
+            s3_client.put_object(Bucket=list_bucket, Key=f"seed-{start}.tar", Body=body, Metadata={"snowball-auto-extract": "true"})
+            return len(body)
+        results["list_seed"] = run_scenario(
+            "list_seed",
+            [lambda start=start: seed(start) for start in range(0, args.list_keys, LIST_SEED_BATCH)],
+            args.concurrency,
+        )
+
+        def list_all():
+            pages = s3_client.get_paginator("list_objects_v2").paginate(Bucket=list_bucket)
+            listed = sum(page.get("KeyCount", 0) for page in pages)
+            if listed != args.list_keys:
+                raise RuntimeError(f"listed {listed} of {args.list_keys} keys")
+            return 0
+        results["list"] = run_scenario("list", [list_all], 1)
+        results["list"]["keys"] = args.list_keys
+
+    if "delete" in scenarios:
+        def delete(batch):
+            response = s3_client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+            if response.get("Errors"):
+                raise RuntimeError(f"{len(response['Errors'])} keys not deleted")
+            return 0
+        batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+        results["delete"] = run_scenario("delete", [lambda b=b: delete(b) for b in batches], args.concurrency)
+        results["delete"]["keys"] = len(keys)
+
+    # With --in-process this process is the server too
+    server_rss = peak_rss_mb() if args.in_process else peak_rss_mb(args.server_pid) if args.server_pid else None
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "endpoint": endpoint,
+        "in_process": args.in_process,
+        "config": {
+            "concurrency": args.concurrency,
+            "objects": args.objects,
+            "size_mix": args.size_mix,
+            "multipart_count": args.multipart_count,
+            "multipart_size": args.multipart_size,
+            "part_size": args.part_size,
+            "list_keys": args.list_keys,
+            "seed": args.seed,
+        },
+        "results": results,
+        "peak_rss_mb": {
+            "client": round(peak_rss_mb(), 1),
+            "server": round(server_rss, 1) if server_rss is not None else None,
+        },
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
+import base64
+import hashlib
+import hmac
+import io
 import os
+import sys
+import tarfile
+import threading
+import time
+import urllib.error
+import urllib.request
 import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
 from botocore.exceptions import ClientError
 from boto3.s3.transfer import TransferConfig
 
@@ -18,6 +31,96 @@ OBJECT_NAME = "my-boto3-test-file.txt"
 LOCAL_UPLOAD_FILE_PATH = "upload-temp-boto3.txt"
 LOCAL_DOWNLOAD_FILE_PATH = "downloaded-file-boto3.txt"
 
+# Seconds to wait for the server's blob garbage collector before re-reading
+# deduplicated data; set it above the server's BLOB_GC_INTERVAL_SECONDS plus
+# BLOB_GC_GRACE_SECONDS to check that collection keeps referenced blobs.
+GC_WAIT_SECONDS = float(os.getenv("GC_WAIT_SECONDS", 0))
+
+# --- Helper Functions ---
+
+failed_checks = []
+
+def check(description, passed):
+    """Reports one feature check; failures make the script exit non-zero."""
+    if passed:
+        print(f"✅ {description}")
+    else:
+        print(f"❌ {description}")
+        failed_checks.append(description)
+
+def error_code(call):
+    """Runs a boto3 call that is expected to fail and returns its S3 error code, or None if it succeeded."""
+    try:
+        call()
+    except ClientError as e:
+        return e.response["Error"]["Code"]
+    return None
+
+def signed_request(method, path, body=b"", headers=None):
+    """
+    Sends a SigV4-signed request for the server's own extensions, which boto3
+    has no calls for. Returns (status, body).
+    """
+    headers = {"x-amz-content-sha256": hashlib.sha256(body).hexdigest(), **(headers or {})}
+    request = AWSRequest(method=method, url=S3_ENDPOINT_URL + path, data=body, headers=headers)
+    SigV4Auth(Credentials(S3_ACCESS_KEY, S3_SECRET_KEY), "s3", S3_REGION).add_auth(request)
+    prepared = urllib.request.Request(request.url, data=body if method in ("PUT", "POST") else None, headers=dict(request.headers), method=method)
+    try:
+        with urllib.request.urlopen(prepared) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def put_aws_chunked(key, data, chunk_size=64 * 1024, tamper=False):
+    """
+    Uploads data as a signed aws-chunked body (STREAMING-AWS4-HMAC-SHA256-PAYLOAD),
+    as SDKs do over TLS. With tamper the first chunk is altered after signing.
+    Returns (status, body).
+    """
+    headers = {
+        "x-amz-content-sha256": "STREAMING-AWS4-HMAC-SHA256-PAYLOAD",
+        "content-encoding": "aws-chunked",
+        "x-amz-decoded-content-length": str(len(data)),
+    }
+    request = AWSRequest(method="PUT", url=f"{S3_ENDPOINT_URL}/{BUCKET_NAME}/{key}", headers=headers)
+    SigV4Auth(Credentials(S3_ACCESS_KEY, S3_SECRET_KEY), "s3", S3_REGION).add_auth(request)
+    timestamp = request.headers["X-Amz-Date"]
+    scope = f"{timestamp[:8]}/{S3_REGION}/s3/aws4_request"
+    signing_key = f"AWS4{S3_SECRET_KEY}".encode()
+    for part in (timestamp[:8], S3_REGION, "s3", "aws4_request"):
+        signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+    previous = request.headers["Authorization"].split("Signature=")[1]
+    body = b""
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] + [b""]
+    for n, chunk in enumerate(chunks):
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256-PAYLOAD", timestamp, scope, previous,
+            hashlib.sha256(b"").hexdigest(), hashlib.sha256(chunk).hexdigest(),
+        ])
+        previous = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        if tamper and n == 0:
+            chunk = b"X" + chunk[1:]
+        body += f"{len(chunk):x};chunk-signature={previous}\r\n".encode() + chunk + b"\r\n"
+    prepared = urllib.request.Request(request.url, data=body, headers=dict(request.headers), method="PUT")
+    try:
+        with urllib.request.urlopen(prepared) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def tar_archive(members):
+    """Builds an uncompressed tar archive from a {name: data} mapping."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def read(key, **kwargs):
+    return s3_client.get_object(Bucket=BUCKET_NAME, Key=key, **kwargs)["Body"].read()
+
 # --- Main Script ---
 
 # Initialize Boto3 S3 client
@@ -91,21 +194,118 @@ try:
         print(f"❌ Get failed: File '{LOCAL_DOWNLOAD_FILE_PATH}' not found after download.")
 
 
-    # == STEP 3: REMOTE CLEANUP (OBJECT & BUCKET) ==
-    print(f"\n[3.1] Deleting object '{OBJECT_NAME}' from bucket '{BUCKET_NAME}'...")
+    # == STEP 3: FEATURE CHECKS ==
+    print("\n[3.1] Small objects, stored inline in the metadata database...")
+    small = os.urandom(1000)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/small", Body=small)
+    check("Small object reads back", read("features/small") == small)
+    check("Range of a small object", read("features/small", Range="bytes=10-19") == small[10:20])
+    s3_client.copy_object(Bucket=BUCKET_NAME, Key="features/small-copy", CopySource={"Bucket": BUCKET_NAME, "Key": "features/small"})
+    check("Copy of a small object", read("features/small-copy") == small)
+    large = os.urandom(300 * 1024)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/small", Body=large)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/small", Body=small)
+    check("Small object overwritten by a large one and back", read("features/small") == small)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/empty", Body=b"")
+    check("Empty object", read("features/empty") == b"")
+
+    print("\n[3.2] Reads after overwrites, with the object cache in between...")
+    bodies = [os.urandom(2000 + i) for i in range(30)]
+    stop = threading.Event()
+
+    def keep_reading():
+        while not stop.is_set():
+            read("features/cached")
+
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/cached", Body=bodies[0])
+    readers = [threading.Thread(target=keep_reading) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for body in bodies[1:]:
+        s3_client.put_object(Bucket=BUCKET_NAME, Key="features/cached", Body=body)
+    stop.set()
+    for reader in readers:
+        reader.join()
+    check("Latest version served after concurrent reads", all(read("features/cached") == bodies[-1] for _ in range(3)))
+    check("HEAD reports the latest size", s3_client.head_object(Bucket=BUCKET_NAME, Key="features/cached")["ContentLength"] == len(bodies[-1]))
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key="features/cached")
+    check("Deleted object no longer served", error_code(lambda: read("features/cached")) == "NoSuchKey")
+
+    print("\n[3.3] Identical data under several keys (deduplicated with STORAGE_LAYOUT=cas)...")
+    shared = os.urandom(256 * 1024)
+    for key in ("features/twin-1", "features/twin-2"):
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=shared)
+    s3_client.copy_object(Bucket=BUCKET_NAME, Key="features/twin-3", CopySource={"Bucket": BUCKET_NAME, "Key": "features/twin-1"})
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key="features/twin-1")
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/twin-2", Body=b"replaced")
+    if GC_WAIT_SECONDS:
+        print(f"Waiting {GC_WAIT_SECONDS:g}s for blob garbage collection...")
+        time.sleep(GC_WAIT_SECONDS)
+    check("Data still referenced survives deleting and overwriting its twins", read("features/twin-3") == shared)
+
+    print("\n[3.4] aws-chunked uploads with signed chunks...")
+    chunked = os.urandom(200 * 1024)
+    status, _ = put_aws_chunked("features/chunked", chunked)
+    check("Signed aws-chunked body decoded", status == 200 and read("features/chunked") == chunked)
+    status, body = put_aws_chunked("features/chunked-tampered", chunked, tamper=True)
+    check("Tampered chunk rejected", status == 403 and b"SignatureDoesNotMatch" in body)
+    check("Tampered upload not stored", error_code(lambda: read("features/chunked-tampered")) == "NoSuchKey")
+
+    print("\n[3.5] Bulk ingest of a tar archive...")
+    members = {"a.txt": b"alpha", "dir/b.bin": os.urandom(100 * 1024), "../escape": b"outside"}
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/ingest/archive.tar", Body=tar_archive(members), Metadata={"snowball-auto-extract": "true"})
+    check("Members extracted under the key's prefix", read("features/ingest/a.txt") == b"alpha" and read("features/ingest/dir/b.bin") == members["dir/b.bin"])
+    check("Archive itself not stored", error_code(lambda: read("features/ingest/archive.tar")) == "NoSuchKey")
+    check("Member climbing out of the prefix skipped", error_code(lambda: read("features/escape")) == "NoSuchKey")
+    replacement = tar_archive({"a.txt": b"changed", "dir/b.bin": os.urandom(100 * 1024), "c.txt": b"new"})
+    wrong_md5 = base64.b64encode(hashlib.md5(b"something else").digest()).decode()
+    check("Archive with a wrong Content-MD5 rejected", error_code(lambda: s3_client.put_object(
+        Bucket=BUCKET_NAME, Key="features/ingest/archive.tar", Body=replacement, ContentMD5=wrong_md5,
+        Metadata={"snowball-auto-extract": "true"},
+    )) == "BadDigest")
+    check("Rejected archive left existing objects intact", read("features/ingest/a.txt") == b"alpha" and read("features/ingest/dir/b.bin") == members["dir/b.bin"])
+    check("Rejected archive created no objects", error_code(lambda: read("features/ingest/c.txt")) == "NoSuchKey")
+
+    print("\n[3.6] Downloading a prefix as a tar archive...")
+    status, body = signed_request("GET", f"/{BUCKET_NAME}?archive&prefix=features%2Fingest%2F")
+    with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+        downloaded = {member.name: archive.extractfile(member).read() for member in archive if member.isfile()}
+    check("Archive holds every object under the prefix", status == 200 and downloaded == {"a.txt": b"alpha", "dir/b.bin": members["dir/b.bin"]})
+
+    print("\n[3.7] Bucket compression...")
+    config = b"<CompressionConfiguration><Algorithm>zlib</Algorithm></CompressionConfiguration>"
+    status, _ = signed_request("PUT", f"/{BUCKET_NAME}?compression", config)
+    check("Compression configured", status == 200)
+    document = b"".join(b'{"id": %d, "message": "hello world"}\n' % i for i in range(100000))
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="features/document.json", Body=document, ContentType="application/json")
+    head = s3_client.head_object(Bucket=BUCKET_NAME, Key="features/document.json")
+    check("Size and ETag are those of the uncompressed data", head["ContentLength"] == len(document) and head["ETag"].strip('"') == hashlib.md5(document).hexdigest())
+    check("Compressed object reads back", read("features/document.json") == document)
+    check("Range across compressed frames", read("features/document.json", Range="bytes=1000000-2500000") == document[1000000:2500001])
+
+
+    # == STEP 4: REMOTE CLEANUP (OBJECTS & BUCKET) ==
+    print(f"\n[4.1] Deleting object '{OBJECT_NAME}' from bucket '{BUCKET_NAME}'...")
     s3_client.delete_object(Bucket=BUCKET_NAME, Key=OBJECT_NAME)
     print("✅ Remote object deleted successfully.")
 
-    print(f"[3.2] Deleting bucket '{BUCKET_NAME}'...")
+    print(f"[4.2] Deleting the feature check objects...")
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME):
+        for obj in page.get("Contents", []):
+            s3_client.delete_object(Bucket=BUCKET_NAME, Key=obj["Key"])
+    print("✅ Feature check objects deleted successfully.")
+
+    print(f"[4.3] Deleting bucket '{BUCKET_NAME}'...")
     s3_client.delete_bucket(Bucket=BUCKET_NAME)
     print("✅ Remote bucket deleted successfully.")
 
 
 except ClientError as exc:
     print(f"\n❌ A Boto3 client error occurred: {exc}")
+    failed_checks.append(str(exc))
 
 finally:
-    # == STEP 4: LOCAL CLEANUP ==
+    # == STEP 5: LOCAL CLEANUP ==
     print("\n--- Starting Local Cleanup ---")
     # Clean up the original uploaded file
     if os.path.exists(LOCAL_UPLOAD_FILE_PATH):
@@ -118,3 +318,7 @@ finally:
         print(f"🧹 Cleaned up local download file: '{LOCAL_DOWNLOAD_FILE_PATH}'")
 
     print("\n--- Test Finished ---")
+
+if failed_checks:
+    print(f"{len(failed_checks)} check(s) failed.")
+    sys.exit(1)